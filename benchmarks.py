@@ -0,0 +1,555 @@
+import os
+import sys
+import gc
+import copy
+import json
+import time
+import random
+import argparse
+import subprocess
+import tracemalloc
+from collections import deque
+
+# Benchmarks never open a window or play sounds
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import bomberman
+from bomberman import (ACTION_BOMB, BLOCK, BOMB_RANGE, HUNTER_TYPES, MAX_ENEMIES, SCREEN_HEIGHT, SCREEN_WIDTH, START_LIVES,
+                       Bomb, DangerMap, Enemy, Explosion, ExplosionMap, FlowField, GameState, LevelLoader, Renderer, Scheduler,
+                       SpatialIndex, create_grid, decode_actions, generate_level, random_policy, spawn_enemies)
+
+pygame = bomberman.pygame
+
+# Every benchmark returns {metric: seconds}, the best of `repeat` runs of one
+# operation (a call, a tick, a whole cascade), so lower is always better and
+# runs can be compared metric by metric. Memory metrics end in "_bytes" and
+# are bytes per object instead.
+
+def best_of(repeat, run):
+    # Fastest of `repeat` calls to run(), which returns the seconds it took.
+    # The garbage collector is off while timing, as in timeit, so a
+    # collection landing in one run doesn't make it look slower.
+    gc.collect()
+    gc.disable()
+    try:
+        return min(run() for _ in range(repeat))
+    finally:
+        gc.enable()
+
+def per_call(function, count, repeat):
+    # Best time of one function() call, over `repeat` runs of `count` calls
+    def run():
+        start = time.perf_counter()
+        for _ in range(count):
+            function()
+        return time.perf_counter() - start
+    return best_of(repeat, run) / count
+
+def open_board(width, height):
+    # Standard map with every destructible block removed
+    grid = create_grid(width, height)
+    blocks = [(i % width, i // width) for i, tile in enumerate(grid.cells) if tile == BLOCK]
+    grid.destroy(blocks)
+    return grid
+
+def bomb_board(width, height):
+    # A game whose every free tile holds a bomb, with nobody around to get hurt
+    state = GameState()
+    state.grid = open_board(width, height)
+    state.fire = ExplosionMap(width, height)
+    state.danger = DangerMap(state.grid, state.scheduler, state.fire)
+    state.enemies = []
+    state.enemy_at = SpatialIndex(width, height)
+    state.bombs = []
+    state.bomb_at = {}
+    for x, y in state.grid.free_cells():
+        bomb = Bomb(x, y, state.scheduler)
+        state.bombs.append(bomb)
+        state.add_bomb(bomb)
+    state.player.x, state.player.y = -1, -1
+    return state
+
+STARTUP_TARGET = 0.4  # Seconds to a headless run's first tick, from a cold interpreter
+
+def bench_startup(repeat=5):
+    # Cold start in a fresh interpreter: importing the module, and a whole
+    # one-tick headless run. Neither should load pygame.
+    here = os.path.dirname(os.path.abspath(__file__))
+    
+    def run(*args):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=here, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+    importing = best_of(repeat, lambda: run("-c", "import bomberman"))
+    headless = best_of(repeat, lambda: run("bomberman.py", "--headless", "--ticks", "1"))
+    check = subprocess.run([sys.executable, "-c", "import sys, bomberman; print('pygame.base' in sys.modules)"],
+                           cwd=here, check=True, capture_output=True, text=True)
+    
+    print(f"startup: import {importing * 1000:.0f} ms, headless run {headless * 1000:.0f} ms "
+          f"(target {STARTUP_TARGET * 1000:.0f} ms{', MISSED' if headless > STARTUP_TARGET else ''})"
+          f"{', pygame loaded on import' if check.stdout.strip() == 'True' else ''}")
+    return {"startup.import": importing, "startup.headless": headless}
+
+def bench_grid(count=500, repeat=5):
+    # Map generation with its reachability pass, on the standard map and on
+    # large ones (with fewer calls the bigger the map)
+    results = {}
+    for width, height in [(bomberman.GRID_WIDTH, bomberman.GRID_HEIGHT), (64, 48), (256, 256)]:
+        rng = random.Random(0)
+        calls = max(3, count * bomberman.GRID_WIDTH * bomberman.GRID_HEIGHT // (width * height))
+        results[f"grid.{width}x{height}"] = per_call(lambda: generate_level(width, height, rng), calls, repeat)
+    
+    print(", ".join(f"{name}: {seconds * 1e6:.1f} us" for name, seconds in results.items()))
+    return results
+
+def bench_spawn(count=2000, repeat=5):
+    # Placing a full level's worth of enemies on a seeded standard map, and
+    # enemies on nine in ten free cells of a large map, per enemy
+    grid, free = generate_level(rng=random.Random(0))
+    clock = Scheduler()
+    rng = random.Random(0)
+    best = per_call(lambda: spawn_enemies(grid, MAX_ENEMIES, clock, HUNTER_TYPES, rng, list(free)), count, repeat)
+    
+    grid, free = generate_level(256, 256, random.Random(0))
+    crowd = len(free) * 9 // 10
+    per_enemy = per_call(lambda: spawn_enemies(grid, crowd, clock, HUNTER_TYPES, rng, list(free)), 3, repeat) / crowd
+    
+    print(f"spawn: {MAX_ENEMIES} enemies in {best * 1e6:.1f} us, {crowd:,} enemies on a 256x256 map "
+          f"at {per_enemy * 1e6:.2f} us each")
+    return {"spawn": best, "spawn.crowd": per_enemy}
+
+def bench_blast(repeat=5):
+    # Explosion.calculate_tiles() on every free tile of a seeded standard
+    # map, blocks breaking as it goes, like a long game of bombing
+    template = create_grid(rng=random.Random(0))
+    tiles = template.free_cells()
+    clock = Scheduler()
+    
+    def run():
+        grid = template.copy()
+        explosion = Explosion(1, 1, BOMB_RANGE, grid, clock)
+        start = time.perf_counter()
+        for explosion.x, explosion.y in tiles:
+            explosion.calculate_tiles(grid)
+        return time.perf_counter() - start
+    best = best_of(repeat, run) / len(tiles)
+    
+    print(f"blast: {best * 1e6:.2f} us per explosion")
+    return {"blast": best}
+
+def burning_board(width, height, enemies):
+    # An open board where every seventh free tile is on fire and every
+    # seventh holds a ticking bomb, crowded with enemies and hunters
+    grid = open_board(width, height)
+    clock = Scheduler()
+    fire = ExplosionMap(width, height)
+    danger = DangerMap(grid, clock, fire)
+    for i, (x, y) in enumerate(grid.free_cells()):
+        if i % 7 == 0:
+            fire.add(Explosion(x, y, BOMB_RANGE, grid, clock))
+        elif i % 7 == 3:
+            danger.add_bomb(Bomb(x, y, clock))
+    flow = FlowField()
+    flow.update(grid, 1, 1)
+    return grid, clock, fire, danger, flow, spawn_enemies(grid, enemies, clock, HUNTER_TYPES, random.Random(0))
+
+def bench_enemies(count=200, steps=50, repeat=5):
+    # Enemy.update() plus the burning check that follows it in
+    # GameState.step(), with the map full of explosions and bombs
+    grid, clock, fire, danger, flow, enemies = burning_board(64, 48, count)
+    start_fields = [enemy.pack() for enemy in enemies]
+    
+    def run():
+        for enemy, fields in zip(enemies, start_fields):
+            enemy.unpack(fields, clock)
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for _ in range(steps):
+            for enemy in enemies:
+                enemy.update(grid, flow, danger, rng)
+                fire.is_burning(enemy.x, enemy.y)
+        return time.perf_counter() - start
+    best = best_of(repeat, run) / (steps * count)
+    
+    print(f"enemies: {best * 1e6:.2f} us per enemy step ({count} enemies, {sum(map(bool, fire.counts))} burning tiles)")
+    return {"enemies": best}
+
+def bench_tick(ticks=2000, repeat=5):
+    # Full GameState.step() of a busy seeded game, restored from the same
+    # snapshot before every run
+    state = busy_game()
+    snapshot = state.snapshot()
+    rng = random.Random(2)
+    inputs = []
+    for _ in range(ticks):
+        actions = random_policy(state, rng)
+        if rng.random() < 0.05:
+            actions.append(ACTION_BOMB)
+        inputs.append(actions)
+    
+    def run():
+        state.restore(snapshot)
+        start = time.perf_counter()
+        for actions in inputs:
+            state.step(actions)
+        return time.perf_counter() - start
+    best = best_of(repeat, run) / ticks
+    
+    print(f"tick: {best * 1e6:.1f} us per tick ({1 / best:,.0f} ticks/sec)")
+    return {"tick": best}
+
+def crowd_game(width, height, count):
+    # A big map crowded with wandering enemies. The player is walled into the
+    # start corner, so nobody dies and every enemy keeps walking.
+    state = GameState(seed=1, width=width, height=height)
+    state.grid.set(2, 1, BLOCK)
+    state.grid.set(1, 2, BLOCK)
+    state.enemies = spawn_enemies(state.grid, count, state.scheduler, rng=random.Random(0))
+    state.restore(state.snapshot())  # Schedules and indexes the new enemies
+    return state
+
+def bench_crowd(width=128, height=96, count=500, ticks=600, repeat=5):
+    # GameState.step() with hundreds of enemies: collisions are a lookup in
+    # the tile index, so a tick costs the steps the enemies take
+    state = crowd_game(width, height, count)
+    snapshot = state.snapshot()
+    
+    def run():
+        state.restore(snapshot)
+        start = time.perf_counter()
+        for _ in range(ticks):
+            state.step()
+        return time.perf_counter() - start
+    best = best_of(repeat, run) / ticks
+    
+    print(f"crowd: {best * 1e6:.1f} us per tick ({count} enemies on a {width}x{height} map)")
+    return {"crowd": best}
+
+def offscreen():
+    # An offscreen Surface in the display's pixel format for the draw calls
+    # to go to, the way the game's sprites are converted for the window
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    bomberman.init_fonts()
+    bomberman.screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+    bomberman.sprite_cache.clear()
+
+def bench_draw(count=2000, repeat=5):
+    # Drawing one entity of each kind, with their sprites already cached as
+    # they are in a running game. Explosions aren't cached and cover the
+    # full cross of tiles.
+    offscreen()
+    state = busy_game()
+    player, bomb, enemies = state.player, state.bombs[0], state.enemies
+    clock = state.scheduler
+    explosion = Explosion(3, 3, BOMB_RANGE, open_board(bomberman.GRID_WIDTH, bomberman.GRID_HEIGHT), clock)
+    effects = random.Random(0)
+    
+    def draw_enemies():
+        for enemy in enemies:
+            enemy.draw(enemy.x, enemy.y)
+    
+    draw_enemies()  # Render the sprites before timing
+    results = {
+        "draw.player": per_call(lambda: player.draw(player.x, player.y), count, repeat),
+        "draw.enemy": per_call(draw_enemies, count // len(enemies), repeat) / len(enemies),
+        "draw.bomb": per_call(lambda: bomb.draw(bomb.x, bomb.y), count, repeat),
+        "draw.explosion": per_call(lambda: explosion.draw(effects), count // 10, repeat),
+    }
+    
+    print(", ".join(f"{name}: {seconds * 1e6:.1f} us" for name, seconds in results.items()))
+    return results
+
+def bench_frame(ticks=300, repeat=5):
+    # Renderer.draw() of a seeded game with hunters, two frames per tick
+    # sliding between tiles, on the standard map and on a large scrolling
+    # one. Only what's on screen is drawn, so both should cost the same.
+    offscreen()
+    results = {}
+    for width, height in [(bomberman.GRID_WIDTH, bomberman.GRID_HEIGHT), (256, 256)]:
+        state = GameState(level=8, seed=1, monster_types=HUNTER_TYPES, width=width, height=height)
+        state.player.lives = 1000
+        snapshot = state.snapshot()
+        
+        def run():
+            state.restore(snapshot)
+            renderer = Renderer(bomberman.screen)
+            rng = random.Random(0)
+            elapsed = 0.0
+            for _ in range(ticks):
+                renderer.remember(state)
+                state.step(random_policy(state, rng))
+                for alpha in (0.5, 1.0):
+                    start = time.perf_counter()
+                    renderer.draw(state, alpha)
+                    elapsed += time.perf_counter() - start
+            return elapsed
+        results[f"frame.{width}x{height}"] = best_of(repeat, run) / (2 * ticks)
+    
+    print(", ".join(f"{name}: {seconds * 1e6:.0f} us" for name, seconds in results.items()))
+    return results
+
+def bench_level(width=256, height=256, repeat=5):
+    # The stall when a level starts on a large map: building it and drawing
+    # its first frame, on the spot and with the level and its background
+    # already built by a LevelLoader during the countdown
+    offscreen()
+    results = {}
+    for name, loaded in [("level.sync", False), ("level.loaded", True)]:
+        def run():
+            state = GameState(seed=1, width=width, height=height)
+            renderer = Renderer(bomberman.screen)
+            renderer.draw(state)
+            state.level += 1
+            if loaded:
+                state.loader = LevelLoader(renderer.prepare)
+                state.loader.start(state.level_args(state.level, state.tick))
+                state.loader.thread.join()
+            start = time.perf_counter()
+            state.start_level(0, START_LIVES)
+            renderer.invalidate()
+            renderer.draw(state)
+            return time.perf_counter() - start
+        results[name] = best_of(repeat, run)
+    
+    print(f"level: starting a {width}x{height} level takes {results['level.sync'] * 1000:.1f} ms, "
+          f"{results['level.loaded'] * 1000:.2f} ms when built ahead")
+    return results
+
+def bench_chain(width=64, height=48, repeat=5):
+    # Detonate one corner bomb of a board packed with bombs and time how long
+    # the whole cascade takes to resolve
+    best = None
+    for _ in range(repeat):
+        state = bomb_board(width, height)
+        count = len(state.bombs)
+        first = state.bomb_at[(1, 1)]
+        first.exploded = True
+        
+        start = time.perf_counter()
+        state.detonate(deque([first]), [])
+        elapsed = time.perf_counter() - start
+        
+        assert not state.bombs, "cascade left bombs behind"
+        best = elapsed if best is None else min(best, elapsed)
+    
+    print(f"chain: {count} bombs on a {width}x{height} board resolved in {best * 1000:.2f} ms "
+          f"({count / best:,.0f} bombs/sec)")
+    return {"chain": best}
+
+def busy_game():
+    # A level 5 game in full swing, with enemies, hunters, bombs and blasts
+    state = GameState(level=5, seed=1, monster_types=HUNTER_TYPES)
+    state.player.bombs = 5
+    state.player.lives = 1000
+    rng = random.Random(1)
+    while len(state.bombs) < 3 or not state.explosions:
+        actions = random_policy(state, rng)
+        if rng.random() < 0.1:
+            actions.append(ACTION_BOMB)
+        state.step(actions)
+    return state
+
+def bench_clone(count=2000, repeat=5):
+    # Clone a game the way a lookahead bot does: snapshot it once, then
+    # restore the snapshot before trying out each move. deepcopy is the
+    # baseline.
+    state = busy_game()
+    snapshot = state.snapshot()
+    best_snapshot = best_restore = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            state.snapshot()
+        elapsed = time.perf_counter() - start
+        best_snapshot = elapsed if best_snapshot is None else min(best_snapshot, elapsed)
+        
+        start = time.perf_counter()
+        for _ in range(count):
+            state.restore(snapshot)
+        elapsed = time.perf_counter() - start
+        best_restore = elapsed if best_restore is None else min(best_restore, elapsed)
+    
+    start = time.perf_counter()
+    for _ in range(count // 10):
+        copy.deepcopy(state)
+    deepcopy_time = (time.perf_counter() - start) * 10
+    
+    print(f"clone: game with {len(state.enemies)} enemies, {len(state.bombs)} bombs and "
+          f"{len(state.explosions)} explosions, snapshot {best_snapshot / count * 1e6:.1f} us, "
+          f"restore {best_restore / count * 1e6:.1f} us ({count / best_restore:,.0f} clones/sec, "
+          f"{deepcopy_time / best_restore:.1f}x faster than deepcopy)")
+    return {"clone.snapshot": best_snapshot / count, "clone.restore": best_restore / count}
+
+def bench_memory(enemies=10000, bombs=1000, repeat=5):
+    # Bytes per enemy and per bomb, with everything they allocate, and the
+    # time to read one enemy's position in a loop over all of them
+    clock = Scheduler()
+    rng = random.Random(0)
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        crowd = [Enemy(rng.randrange(1, 255), rng.randrange(1, 255), clock, HUNTER_TYPES, rng) for _ in range(enemies)]
+        middle = tracemalloc.get_traced_memory()[0]
+        placed = [Bomb(rng.randrange(1, 255), rng.randrange(1, 255), clock) for _ in range(bombs)]
+        end = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    enemy_bytes = (middle - start) / enemies
+    bomb_bytes = (end - middle) / bombs
+    
+    def scan():
+        for enemy in crowd:
+            if enemy.alive and enemy.x == 0 and enemy.y == 0:
+                break
+    best = per_call(scan, 100, repeat) / enemies
+    
+    print(f"memory: {enemy_bytes:.0f} bytes per enemy ({enemies:,}), {bomb_bytes:.0f} bytes per bomb ({len(placed):,}), "
+          f"{best * 1e9:.1f} ns per enemy read")
+    return {"memory.enemy_bytes": enemy_bytes, "memory.bomb_bytes": bomb_bytes, "memory.scan": best}
+
+def bench_vec(num_envs=16384, ticks=200, warmup=600, repeat=5):
+    # Games stepped per second by the batch environment against looping
+    # over GameStates, both fed random inputs. Both sides start a new game
+    # with a fresh map after a win or a death, so both pay for generating
+    # it, and both run `warmup` ticks first so that the games are at all
+    # stages, the way they settle in a long run.
+    import numpy as np
+    from vec_env import VecBombermanEnv, random_actions
+    
+    rng = np.random.default_rng(0)
+    env = VecBombermanEnv(num_envs, seed=0)
+    inputs = [random_actions(rng, num_envs) for _ in range(ticks)]
+    games = [GameState(seed=i) for i in range(64)]
+    scalar_inputs = [[decode_actions(int(code)) for code in random_actions(rng, len(games))] for _ in range(ticks)]
+    
+    def run_vec():
+        start = time.perf_counter()
+        for actions in inputs:
+            env.step(actions)
+        return time.perf_counter() - start
+    
+    def run_scalar():
+        start = time.perf_counter()
+        for actions in scalar_inputs:
+            for state, action in zip(games, actions):
+                state.step(action)
+                if state.win or state.game_over:
+                    state.restart()
+        return time.perf_counter() - start
+    
+    for _ in range(warmup // ticks):
+        run_vec()
+        run_scalar()
+    # The two sides take turns, so that a busy spell on the machine slows
+    # both down rather than just one
+    gc.collect()
+    gc.disable()
+    try:
+        runs = [(run_vec(), run_scalar()) for _ in range(repeat)]
+    finally:
+        gc.enable()
+    best = min(vec for vec, _ in runs)
+    scalar_best = min(scalar for _, scalar in runs)
+    vec_rate = num_envs * ticks / best
+    scalar_rate = len(games) * ticks / scalar_best
+    
+    print(f"vec: {num_envs} games stepped at {vec_rate:,.0f} game ticks/sec, "
+          f"{vec_rate / scalar_rate:.0f}x looping over GameStates ({scalar_rate:,.0f} ticks/sec)")
+    return {"vec.step": best / ticks, "vec.scalar_tick": scalar_best / (len(games) * ticks)}
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "grid": bench_grid,
+    "spawn": bench_spawn,
+    "blast": bench_blast,
+    "enemies": bench_enemies,
+    "tick": bench_tick,
+    "crowd": bench_crowd,
+    "draw": bench_draw,
+    "frame": bench_frame,
+    "level": bench_level,
+    "chain": bench_chain,
+    "clone": bench_clone,
+    "memory": bench_memory,
+    "vec": bench_vec,
+}
+
+def environment():
+    # What the numbers were measured with, stored next to them
+    return {
+        "python": sys.version.split()[0],
+        "pygame": pygame.version.ver,
+        "numpy": bomberman.np.__version__ if bomberman.np is not None else None,
+        "platform": sys.platform,
+    }
+
+def write_results(path, results, repeat):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "repeat": repeat, "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def show(name, value):
+    # A metric right-aligned in its unit: bytes, or seconds in microseconds
+    if name.endswith("_bytes"):
+        return f"{value:>11.0f}B"
+    return f"{value * 1e6:>10.2f}us"
+
+def compare(results, baseline, threshold):
+    # Print every metric against the baseline and return the names of the
+    # ones that got slower by more than `threshold` (0.2 is 20%)
+    regressions = []
+    print(f"\n{'metric':<22}{'baseline':>12}{'now':>12}{'change':>9}")
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<22}{'':>12}{show(name, value)}      new")
+            continue
+        change = value / old - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<22}{show(name, old)}{show(name, value)}{change:>+9.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bomberman engine benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per benchmark, the best one is reported")
+    parser.add_argument("--json", metavar="PATH", help="write the results to this JSON file (e.g. to make a baseline)")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against results written earlier with --json")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown against the baseline reported as a regression (default: 0.2 for 20%%)")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    
+    results = {}
+    for name in args.names or BENCHMARKS:
+        if name == "vec" and bomberman.np is None:
+            print("vec: skipped, needs NumPy")
+            continue
+        results.update(BENCHMARKS[name](repeat=args.repeat))
+    
+    if args.json:
+        write_results(args.json, results, args.repeat)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    status = main()
+    if bomberman.screen is not None:
+        pygame.quit()
+    sys.exit(status)
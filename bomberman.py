@@ -1,12 +1,41 @@
-import pygame
 import sys
 import random
 import os
 import math
+import time
+import argparse
+import heapq
+import wave
+import threading
+import importlib.util
+from io import BytesIO
+from array import array
+from collections import OrderedDict, deque
+from functools import lru_cache
+from itertools import compress
 
-# Initialize pygame
-pygame.init()
-pygame.mixer.init()  # Initialize sound mixer
+def lazy_import(name):
+    # The module is only really imported the first time one of its attributes
+    # is used. Importing this file runs no pygame or NumPy code and touches no
+    # display, audio device or file, so the headless simulation and the tools
+    # built on it start without paying for either.
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+pygame = lazy_import("pygame")
+
+# NumPy is optional, it only speeds up the whole-grid queries on Grid
+np = lazy_import("numpy") if importlib.util.find_spec("numpy") else None
 
 # Constants
 SCREEN_WIDTH = 800
@@ -15,6 +44,11 @@ GRID_SIZE = 50
 GRID_WIDTH = SCREEN_WIDTH // GRID_SIZE
 GRID_HEIGHT = SCREEN_HEIGHT // GRID_SIZE
 
+# Tile types
+EMPTY = 0
+WALL = 1   # Indestructible
+BLOCK = 2  # Destructible
+
 # Colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -29,81 +63,280 @@ PURPLE = (128, 0, 128)
 # Create monster types
 MONSTER_TYPES = ["slime", "ghost", "goblin"]
 
-# Sound effects
-try:
-    # Create assets directory if it doesn't exist
-    sound_dir = os.path.join("assets", "sounds")
-    os.makedirs(sound_dir, exist_ok=True)
-    
-    # Sound file paths
-    SOUND_BOMB = os.path.join(sound_dir, "bomb.wav")
-    SOUND_EXPLOSION = os.path.join(sound_dir, "explosion.wav")
-    SOUND_ENEMY_DIE = os.path.join(sound_dir, "enemy_die.wav")
-    SOUND_PLAYER_DIE = os.path.join(sound_dir, "player_die.wav")
-    SOUND_GAME_OVER = os.path.join(sound_dir, "game_over.wav")
-    SOUND_WIN = os.path.join(sound_dir, "win.wav")
-    SOUND_BACKGROUND = os.path.join(sound_dir, "background.wav")
-    
-    # Create empty sound files if they don't exist
-    for sound_file in [SOUND_BOMB, SOUND_EXPLOSION, SOUND_ENEMY_DIE, 
-                      SOUND_PLAYER_DIE, SOUND_GAME_OVER, SOUND_WIN, SOUND_BACKGROUND]:
-        if not os.path.exists(sound_file):
-            with open(sound_file, 'wb') as f:
-                # Create a minimal valid WAV file
-                # RIFF header
-                f.write(b'RIFF')
-                f.write((36).to_bytes(4, 'little'))  # File size - 8
-                f.write(b'WAVE')
-                # Format chunk
-                f.write(b'fmt ')
-                f.write((16).to_bytes(4, 'little'))  # Chunk size
-                f.write((1).to_bytes(2, 'little'))   # PCM format
-                f.write((1).to_bytes(2, 'little'))   # Mono
-                f.write((22050).to_bytes(4, 'little'))  # Sample rate
-                f.write((22050).to_bytes(4, 'little'))  # Byte rate
-                f.write((1).to_bytes(2, 'little'))   # Block align
-                f.write((8).to_bytes(2, 'little'))   # Bits per sample
-                # Data chunk
-                f.write(b'data')
-                f.write((0).to_bytes(4, 'little'))   # Data size
-    
-    # Load sounds
-    sound_bomb = pygame.mixer.Sound(SOUND_BOMB)
-    sound_explosion = pygame.mixer.Sound(SOUND_EXPLOSION)
-    sound_enemy_die = pygame.mixer.Sound(SOUND_ENEMY_DIE)
-    sound_player_die = pygame.mixer.Sound(SOUND_PLAYER_DIE)
-    sound_game_over = pygame.mixer.Sound(SOUND_GAME_OVER)
-    sound_win = pygame.mixer.Sound(SOUND_WIN)
-    
-    # Start background music
-    pygame.mixer.music.load(SOUND_BACKGROUND)
-    pygame.mixer.music.set_volume(0.5)
-    pygame.mixer.music.play(-1)  # Loop indefinitely
-    
-    has_sound = True
-    
-except Exception as e:
-    print(f"Error loading sounds: {e}")
-    has_sound = False
-    
-    # Create dummy sound class if loading fails
-    class DummySound:
-        def play(self):
-            pass
-    
-    sound_bomb = DummySound()
-    sound_explosion = DummySound()
-    sound_enemy_die = DummySound()
-    sound_player_die = DummySound()
-    sound_game_over = DummySound()
-    sound_win = DummySound()
-
-# Create the screen
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Bomberman")
-clock = pygame.time.Clock()
+# Hunters chase the player along a shared flow field instead of wandering.
+# They only spawn when asked for, e.g. GameState(monster_types=HUNTER_TYPES)
+HUNTER = "hunter"
+HUNTER_TYPES = MONSTER_TYPES + [HUNTER]
+MONSTER_BEHAVIORS = {
+    "slime": "wander",
+    "ghost": "wander",
+    "goblin": "wander",
+    HUNTER: "hunt",
+}
+MONSTER_NAMES = list(MONSTER_BEHAVIORS)
+
+# Sound effects are synthesized in memory the first time sound is needed,
+# so the game needs no sound files and never writes to disk. A real
+# recording in one of these files replaces the synthesized sound.
+sound_dir = os.path.join("assets", "sounds")
+
+# Sound file paths
+SOUND_BOMB = os.path.join(sound_dir, "bomb.wav")
+SOUND_EXPLOSION = os.path.join(sound_dir, "explosion.wav")
+SOUND_ENEMY_DIE = os.path.join(sound_dir, "enemy_die.wav")
+SOUND_PLAYER_DIE = os.path.join(sound_dir, "player_die.wav")
+SOUND_GAME_OVER = os.path.join(sound_dir, "game_over.wav")
+SOUND_WIN = os.path.join(sound_dir, "win.wav")
+SOUND_BACKGROUND = os.path.join(sound_dir, "background.wav")
+
+SAMPLE_RATE = 22050
+MUSIC_VOLUME = 0.5
+
+def note(number):
+    # Frequency of a MIDI note number (69 is the A above middle C)
+    return 440.0 * 2 ** ((number - 69) / 12)
+
+def tone(duration, start, end=None, shape="sine", decay=0.0, volume=1.0, rate=SAMPLE_RATE):
+    # Samples in -1..1 of a tone gliding from `start` to `end` Hz and fading
+    # out exponentially by `decay`. The last 5 ms ramp down to avoid a click.
+    end = start if end is None else end
+    count = int(duration * rate)
+    ramp = rate * 0.005
+    noise = random.Random(count)
+    samples = []
+    phase = 0.0
+    for i in range(count):
+        t = i / count
+        phase += (start + (end - start) * t) / rate
+        if shape == "square":
+            value = 1.0 if phase % 1.0 < 0.5 else -1.0
+        elif shape == "noise":
+            value = noise.uniform(-1.0, 1.0)
+        else:
+            value = math.sin(2 * math.pi * phase)
+        samples.append(value * volume * math.exp(-decay * t) * min(1.0, (count - i) / ramp))
+    return samples
+
+def mix(*tracks):
+    samples = [0.0] * max(len(track) for track in tracks)
+    for track in tracks:
+        for i, value in enumerate(track):
+            samples[i] += value
+    return samples
+
+def lowpass(samples, amount):
+    # One-pole filter, the smaller `amount` the more muffled
+    out = []
+    value = 0.0
+    for sample in samples:
+        value += amount * (sample - value)
+        out.append(value)
+    return out
+
+def synth_bomb(rate):
+    return mix(tone(0.15, 180, 60, decay=6, volume=0.6, rate=rate),
+               tone(0.1, 0, shape="noise", decay=12, volume=0.2, rate=rate))
+
+def synth_explosion(rate):
+    return mix(lowpass(tone(0.9, 0, shape="noise", decay=5, volume=1.6, rate=rate), 0.08),
+               tone(0.5, 90, 30, decay=4, volume=0.5, rate=rate))
+
+def synth_enemy_die(rate):
+    return tone(0.25, 900, 200, shape="square", decay=3, volume=0.25, rate=rate)
+
+def synth_player_die(rate):
+    return (tone(0.2, 700, 500, shape="square", volume=0.25, rate=rate) +
+            tone(0.2, 500, 350, shape="square", volume=0.25, rate=rate) +
+            tone(0.5, 350, 90, shape="square", decay=2, volume=0.25, rate=rate))
+
+def synth_game_over(rate):
+    return (tone(0.3, note(67), shape="square", decay=1, volume=0.25, rate=rate) +
+            tone(0.3, note(64), shape="square", decay=1, volume=0.25, rate=rate) +
+            tone(0.8, note(60), shape="square", decay=3, volume=0.25, rate=rate))
+
+def synth_win(rate):
+    samples = []
+    for number in (72, 76, 79):
+        samples += tone(0.12, note(number), shape="square", volume=0.25, rate=rate)
+    return samples + tone(0.5, note(84), shape="square", decay=3, volume=0.25, rate=rate)
+
+def synth_music(rate):
+    # Eight bars of a bass arpeggio over C, A minor, F and G, which loop
+    samples = []
+    for root in (48, 45, 41, 43) * 2:
+        for step in (0, 7, 12, 7, 0, 7, 12, 7):
+            samples += tone(0.125, note(root + step), shape="square", decay=4, volume=0.2, rate=rate)
+    return lowpass(samples, 0.3)
+
+# Game event -> (file that overrides it, synthesizer). "win" plays during the
+# level complete countdown.
+SOUND_EFFECTS = {
+    "bomb_placed": (SOUND_BOMB, synth_bomb),
+    "explosion": (SOUND_EXPLOSION, synth_explosion),
+    "enemy_died": (SOUND_ENEMY_DIE, synth_enemy_die),
+    "player_died": (SOUND_PLAYER_DIE, synth_player_die),
+    "game_over": (SOUND_GAME_OVER, synth_game_over),
+    "win": (SOUND_WIN, synth_win),
+}
+sounds = {}  # Filled in by the sound thread, an effect plays once it's there
+has_sound = None  # Not known until init_sound() has run
+
+def pcm(samples, channels=1):
+    # Signed 16-bit samples in native byte order, the mixer's format
+    data = array("h", [int(max(-1.0, min(1.0, sample)) * 32767) for sample in samples])
+    if channels > 1:
+        data = array("h", [value for value in data for _ in range(channels)])
+    return data
+
+def wav_file(samples, rate):
+    # An in-memory WAV file, for pygame.mixer.music which only plays files
+    data = pcm(samples)
+    if sys.byteorder == "big":
+        data.byteswap()
+    stream = BytesIO()
+    with wave.open(stream, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(data.tobytes())
+    stream.seek(0)
+    return stream
+
+def load_override(path):
+    # The sound in `path` if there is a real one (the empty placeholders
+    # older versions wrote don't count)
+    if not os.path.exists(path):
+        return None
+    sound = pygame.mixer.Sound(path)
+    return sound if sound.get_length() > 0 else None
+
+def load_sounds():
+    # Runs on the sound thread. Effects become playable one by one, the
+    # short ones first, and the music starts once it's ready.
+    try:
+        rate, _, channels = pygame.mixer.get_init()
+        for event, (path, synth) in SOUND_EFFECTS.items():
+            sound = load_override(path)
+            if sound is None:
+                sound = pygame.mixer.Sound(buffer=pcm(synth(rate), channels).tobytes())
+            sounds[event] = sound
+        
+        if load_override(SOUND_BACKGROUND):
+            pygame.mixer.music.load(SOUND_BACKGROUND)
+        else:
+            pygame.mixer.music.load(wav_file(synth_music(rate), rate), "wav")
+        pygame.mixer.music.set_volume(MUSIC_VOLUME)
+        pygame.mixer.music.play(-1)  # Loop indefinitely
+    except pygame.error as e:
+        print(f"Error loading sounds: {e}")
+
+def init_sound():
+    # Open the mixer and start making the sounds on a background thread, the
+    # first time it is called. Returns whether sound works.
+    global has_sound
+    if has_sound is not None:
+        return has_sound
+    try:
+        pygame.mixer.init(SAMPLE_RATE, -16, 1)
+        has_sound = True
+    except pygame.error as e:
+        print(f"Error opening the mixer: {e}")
+        has_sound = False
+        return False
+    threading.Thread(target=load_sounds, name="sounds", daemon=True).start()
+    return True
+
+# The window, clock and background music are only created by init_display(),
+# so the simulation can run without a display
+screen = None
+clock = None
+
+def init_display():
+    global screen, clock
+    pygame.mixer.pre_init(SAMPLE_RATE, -16, 1)
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Bomberman")
+    clock = pygame.time.Clock()
+    init_fonts()
+    init_sound()  # Sounds and music come in from a background thread
+
+class LRUCache:
+    # Bounded cache that evicts the least recently used entry once full
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def get(self, key, build, *args):
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+        
+        self.misses += 1
+        value = build(*args)
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+    
+    def clear(self):
+        self.data.clear()
+
+# Fonts are looked up once and rendered text is reused until it changes,
+# so the HUD only re-renders the score or lives when the value changes
+FONT_SIZES = (20, 36, 48, 72)
+TEXT_CACHE_SIZE = 128
+fonts = {}
+text_cache = LRUCache(TEXT_CACHE_SIZE)
+
+def init_fonts():
+    for size in FONT_SIZES:
+        get_font(size)
+
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = fonts[size] = pygame.font.SysFont(None, size)
+    return font
+
+def render_text(size, text, color):
+    return text_cache.get((size, text, color), _render_text, size, text, color)
+
+def _render_text(size, text, color):
+    return get_font(size).render(text, True, color)
+
+# Entities are rendered once per distinct look into a sprite that covers
+# their tile plus half a tile above it (for fuses and antennas), then blitted
+SPRITE_OFFSET = GRID_SIZE // 2
+SPRITE_SIZE = (GRID_SIZE, GRID_SIZE + SPRITE_OFFSET)
+SPRITE_CACHE_SIZE = 256
+sprite_cache = LRUCache(SPRITE_CACHE_SIZE)
+
+def make_sprite(render):
+    sprite = pygame.Surface(SPRITE_SIZE, pygame.SRCALPHA)
+    render(sprite, 0, SPRITE_OFFSET)
+    if pygame.display.get_surface() is not None:
+        sprite = sprite.convert_alpha()
+    return sprite
+
+def draw_sprite(key, render, x, y):
+    # (x, y) is in tiles, and between two tiles while a step is interpolated
+    sprite = sprite_cache.get(key, make_sprite, render)
+    return screen.blit(sprite, (round(x * GRID_SIZE), round(y * GRID_SIZE) - SPRITE_OFFSET))
 
 class Player:
+    __slots__ = ("x", "y", "bombs", "speed", "alive", "lives", "score", "direction", "animation_frame",
+                 "animation_counter", "animation_speed", "last_moved", "next_move_at")
+    
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -117,8 +350,9 @@ class Player:
         self.animation_counter = 0
         self.animation_speed = 5
         self.last_moved = False
+        self.next_move_at = 0  # Tick at which a held arrow key moves again
     
-    def move(self, dx, dy, grid):
+    def move(self, dx, dy, grid, bombs=()):
         new_x = self.x + dx
         new_y = self.y + dy
         
@@ -127,16 +361,19 @@ class Player:
             self.direction = (dx, dy)
             self.last_moved = True
         
-        # Check if the new position is valid
-        if (0 <= new_x < GRID_WIDTH and 0 <= new_y < GRID_HEIGHT and 
-            grid[new_y][new_x] == 0):
+        # Check if the new position is valid. Bombs (the tiles in `bombs`)
+        # block the way, but the player can step off the one they just dropped.
+        if grid.is_walkable(new_x, new_y) and (new_x, new_y) not in bombs:
             self.x = new_x
             self.y = new_y
     
-    def place_bomb(self, bombs):
+    def place_bomb(self, bombs, clock):
         if self.bombs > 0:
-            bombs.append(Bomb(self.x, self.y))
+            bomb = Bomb(self.x, self.y, clock)
+            bombs.append(bomb)
             self.bombs -= 1
+            return bomb
+        return None
     
     def lose_life(self):
         self.lives -= 1
@@ -144,6 +381,20 @@ class Player:
             self.alive = False
         return self.alive
     
+    # Every attribute as a tuple of ints, for GameState.snapshot()
+    def pack(self):
+        return (self.x, self.y, self.bombs, self.speed, self.alive, self.lives, self.score,
+                self.direction[0], self.direction[1], self.animation_frame,
+                self.animation_counter, self.animation_speed, self.last_moved, self.next_move_at)
+    
+    def unpack(self, fields, clock=None):
+        (self.x, self.y, self.bombs, self.speed, alive, self.lives, self.score,
+         dx, dy, self.animation_frame,
+         self.animation_counter, self.animation_speed, last_moved, self.next_move_at) = fields
+        self.alive = bool(alive)
+        self.direction = (dx, dy)
+        self.last_moved = bool(last_moved)
+    
     def update(self):
         # Update animation
         if self.last_moved:
@@ -153,15 +404,22 @@ class Player:
                 self.animation_frame = (self.animation_frame + 1) % 4
             self.last_moved = False
     
-    def draw(self):
+    def sprite_key(self):
+        # Everything the player's look depends on
+        return ("player", self.direction, self.animation_frame % 2)
+    
+    def draw(self, x, y):
+        draw_sprite(self.sprite_key(), self.render, x, y)
+    
+    def render(self, surface, ox, oy):
         # Base player body (rounded rectangle)
-        player_rect = pygame.Rect(self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 5, 
+        player_rect = pygame.Rect(ox + 5, oy + 5, 
                                  GRID_SIZE - 10, GRID_SIZE - 10)
-        pygame.draw.rect(screen, BLUE, player_rect, border_radius=8)
+        pygame.draw.rect(surface, BLUE, player_rect, border_radius=8)
         
         # Draw face based on direction
-        face_x = self.x * GRID_SIZE + GRID_SIZE // 2
-        face_y = self.y * GRID_SIZE + GRID_SIZE // 2
+        face_x = ox + GRID_SIZE // 2
+        face_y = oy + GRID_SIZE // 2
         
         # Eyes
         eye_offset_x = 0
@@ -179,154 +437,208 @@ class Player:
             eye_offset_y = -3
         
         # Left eye
-        pygame.draw.circle(screen, WHITE, 
+        pygame.draw.circle(surface, WHITE, 
                          (face_x - 8 + eye_offset_x, face_y - 5 + eye_offset_y), 
                          4)
-        pygame.draw.circle(screen, BLACK, 
+        pygame.draw.circle(surface, BLACK, 
                          (face_x - 8 + eye_offset_x, face_y - 5 + eye_offset_y), 
                          2)
         
         # Right eye
-        pygame.draw.circle(screen, WHITE, 
+        pygame.draw.circle(surface, WHITE, 
                          (face_x + 8 + eye_offset_x, face_y - 5 + eye_offset_y), 
                          4)
-        pygame.draw.circle(screen, BLACK, 
+        pygame.draw.circle(surface, BLACK, 
                          (face_x + 8 + eye_offset_x, face_y - 5 + eye_offset_y), 
                          2)
         
         # Mouth (changes with animation frame)
         if self.animation_frame % 2 == 0:
             # Smile
-            pygame.draw.arc(screen, BLACK, 
+            pygame.draw.arc(surface, BLACK, 
                           (face_x - 10, face_y + 2, 20, 10),
                           0, 3.14, 2)
         else:
             # "O" mouth
-            pygame.draw.circle(screen, BLACK, (face_x, face_y + 7), 5, 2)
+            pygame.draw.circle(surface, BLACK, (face_x, face_y + 7), 5, 2)
         
         # Draw helmet/hat
         helmet_color = (50, 50, 200)  # Darker blue
-        pygame.draw.ellipse(screen, helmet_color,
-                          (self.x * GRID_SIZE + 5, self.y * GRID_SIZE, 
+        pygame.draw.ellipse(surface, helmet_color,
+                          (ox + 5, oy, 
                            GRID_SIZE - 10, GRID_SIZE // 3))
         
         # Draw antenna on helmet
-        pygame.draw.line(screen, BLACK,
-                       (face_x, self.y * GRID_SIZE + 2),
-                       (face_x, self.y * GRID_SIZE - 8),
+        pygame.draw.line(surface, BLACK,
+                       (face_x, oy + 2),
+                       (face_x, oy - 8),
                        2)
-        pygame.draw.circle(screen, RED, (face_x, self.y * GRID_SIZE - 8), 3)
+        pygame.draw.circle(surface, RED, (face_x, oy - 8), 3)
 
 class Enemy:
-    def __init__(self, x, y):
+    # Fixed attributes and no per-instance dict: a level on a big map can
+    # hold thousands of enemies
+    __slots__ = ("x", "y", "speed", "clock", "spawned_at", "move_delay", "next_move_at", "alive", "direction",
+                 "monster_type", "behavior", "animation_speed")
+    
+    def __init__(self, x, y, clock, monster_types=MONSTER_TYPES, rng=random):
         self.x = x
         self.y = y
         self.speed = 1
-        self.move_counter = 0
-        self.move_delay = 15  # Move every 15 frames (0.5 seconds at 30 FPS)
+        self.clock = clock
+        self.spawned_at = clock.tick
+        self.move_delay = ENEMY_MOVE_DELAY  # Move every 15 ticks (0.5 seconds)
+        self.next_move_at = self.spawned_at + self.move_delay
         self.alive = True
-        self.direction = random.choice([(0, 1), (0, -1), (1, 0), (-1, 0)])
-        self.monster_type = random.choice(MONSTER_TYPES)
-        self.animation_frame = 0
+        self.direction = rng.choice([(0, 1), (0, -1), (1, 0), (-1, 0)])
+        self.monster_type = rng.choice(monster_types)
+        self.behavior = MONSTER_BEHAVIORS[self.monster_type]
         self.animation_speed = 5
-        self.animation_counter = 0
+    
+    # Monster colors based on type
+    colors = {
+        "slime": (0, 200, 0),      # Green slime
+        "ghost": (200, 200, 255),  # Light blue ghost
+        "goblin": (255, 100, 0),   # Orange goblin
+        "hunter": (150, 0, 40)     # Dark red hunter
+    }
+    
+    @property
+    def animation_frame(self):
+        return (self.clock.tick - self.spawned_at) // self.animation_speed % 4
+    
+    def pack(self):
+        return (self.x, self.y, self.speed, self.spawned_at, self.move_delay, self.next_move_at,
+                self.alive, self.direction[0], self.direction[1],
+                MONSTER_NAMES.index(self.monster_type), self.animation_speed)
+    
+    def unpack(self, fields, clock):
+        (self.x, self.y, self.speed, self.spawned_at, self.move_delay, self.next_move_at,
+         alive, dx, dy, monster_type, self.animation_speed) = fields
+        self.clock = clock
+        self.alive = bool(alive)
+        self.direction = (dx, dy)
+        self.monster_type = MONSTER_NAMES[monster_type]
+        self.behavior = MONSTER_BEHAVIORS[self.monster_type]
+    
+    def hunt(self, flow, danger, bombs=()):
+        # Next step towards the player that doesn't walk into a blast before
+        # the following step. If every step closer is dangerous, wait, unless
+        # this tile is about to burn too, then dodge to any safe tile. Bombs
+        # block the way like walls do.
+        def safe(x, y):
+            return danger is None or danger.is_safe(x, y, self.move_delay)
         
-        # Monster colors based on type
-        self.colors = {
-            "slime": (0, 200, 0),      # Green slime
-            "ghost": (200, 200, 255),  # Light blue ghost
-            "goblin": (255, 100, 0)    # Orange goblin
-        }
-    
-    def update(self, grid, explosions):
-        # Check if enemy is hit by explosion
-        for explosion in explosions:
-            for x, y in explosion.tiles:
-                if self.x == x and self.y == y:
-                    self.alive = False
-                    return
-        
-        # Move enemy
-        self.move_counter += 1
-        if self.move_counter >= self.move_delay:
-            self.move_counter = 0
-            
-            # Try to move in current direction
-            new_x = self.x + self.direction[0]
-            new_y = self.y + self.direction[1]
-            
-            # If can't move in current direction, choose a new random direction
-            if not (0 <= new_x < GRID_WIDTH and 0 <= new_y < GRID_HEIGHT and grid[new_y][new_x] == 0):
-                # Choose a new random direction
-                possible_directions = []
-                for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                    nx, ny = self.x + dx, self.y + dy
-                    if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT and grid[ny][nx] == 0:
-                        possible_directions.append((dx, dy))
-                
-                if possible_directions:
-                    self.direction = random.choice(possible_directions)
-                    new_x = self.x + self.direction[0]
-                    new_y = self.y + self.direction[1]
-                else:
-                    # No valid moves, stay in place
-                    return
+        here = flow.distance(self.x, self.y)
+        steps = []
+        for dx, dy in FLOW_DIRECTIONS:
+            there = flow.distance(self.x + dx, self.y + dy)
+            if there is not None and (self.x + dx, self.y + dy) not in bombs:
+                steps.append((there, (dx, dy)))
+        steps.sort(key=lambda step: step[0])
+        
+        for there, (dx, dy) in steps:
+            if there < here and safe(self.x + dx, self.y + dy):
+                return (dx, dy)
+        if not safe(self.x, self.y):
+            for there, (dx, dy) in steps:
+                if safe(self.x + dx, self.y + dy):
+                    return (dx, dy)
+        return None
+    
+    def update(self, grid, flow=None, danger=None, rng=random, bombs=()):
+        # Take one step, called by GameState every move_delay ticks. Enemies
+        # can't walk onto the tiles in `bombs`. Returns whether the enemy moved.
+        self.next_move_at += self.move_delay
+        
+        # Hunters walk downhill on the flow field and only wander when the
+        # player can't be reached
+        if self.behavior == "hunt" and flow is not None and flow.distance(self.x, self.y) is not None:
+            direction = self.hunt(flow, danger, bombs)
+            if direction is None:
+                return False
+            self.direction = direction
+            self.x += direction[0]
+            self.y += direction[1]
+            return True
+        
+        # Try to move in current direction
+        new_x = self.x + self.direction[0]
+        new_y = self.y + self.direction[1]
+        
+        # If can't move in current direction, choose a new random direction
+        if not grid.is_walkable(new_x, new_y) or (new_x, new_y) in bombs:
+            # Choose a new random direction
+            possible_directions = []
+            for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+                if grid.is_walkable(self.x + dx, self.y + dy) and (self.x + dx, self.y + dy) not in bombs:
+                    possible_directions.append((dx, dy))
             
-            self.x, self.y = new_x, new_y
+            if possible_directions:
+                self.direction = rng.choice(possible_directions)
+                new_x = self.x + self.direction[0]
+                new_y = self.y + self.direction[1]
+            else:
+                # No valid moves, stay in place
+                return False
         
-        # Update animation
-        self.animation_counter += 1
-        if self.animation_counter >= self.animation_speed:
-            self.animation_counter = 0
-            self.animation_frame = (self.animation_frame + 1) % 4
+        self.x, self.y = new_x, new_y
+        return True
+    
+    def sprite_key(self):
+        # Only ghosts and hunters look where they are going
+        direction = self.direction if self.monster_type in ("ghost", HUNTER) else None
+        return ("enemy", self.monster_type, self.animation_frame % 2, direction)
     
-    def draw(self):
+    def draw(self, x, y):
         if not self.alive:
             return
-            
+        draw_sprite(self.sprite_key(), self.render, x, y)
+    
+    def render(self, surface, ox, oy):
         color = self.colors.get(self.monster_type, ORANGE)
-        rect = pygame.Rect(self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 5, 
+        rect = pygame.Rect(ox + 5, oy + 5, 
                           GRID_SIZE - 10, GRID_SIZE - 10)
         
         # Draw base monster shape
-        pygame.draw.rect(screen, color, rect)
+        pygame.draw.rect(surface, color, rect)
         
         # Draw monster features based on type
         if self.monster_type == "slime":
             # Draw slime eyes
             eye_size = GRID_SIZE // 8
-            eye_y = self.y * GRID_SIZE + GRID_SIZE // 3
+            eye_y = oy + GRID_SIZE // 3
             
             # Eyes move slightly based on animation frame
             eye_offset = self.animation_frame % 2 * 2
             
             # Left eye
-            pygame.draw.circle(screen, WHITE, 
-                             (self.x * GRID_SIZE + GRID_SIZE // 3, eye_y + eye_offset), 
+            pygame.draw.circle(surface, WHITE, 
+                             (ox + GRID_SIZE // 3, eye_y + eye_offset), 
                              eye_size)
-            pygame.draw.circle(screen, BLACK, 
-                             (self.x * GRID_SIZE + GRID_SIZE // 3, eye_y + eye_offset), 
+            pygame.draw.circle(surface, BLACK, 
+                             (ox + GRID_SIZE // 3, eye_y + eye_offset), 
                              eye_size // 2)
             
             # Right eye
-            pygame.draw.circle(screen, WHITE, 
-                             (self.x * GRID_SIZE + GRID_SIZE * 2 // 3, eye_y + eye_offset), 
+            pygame.draw.circle(surface, WHITE, 
+                             (ox + GRID_SIZE * 2 // 3, eye_y + eye_offset), 
                              eye_size)
-            pygame.draw.circle(screen, BLACK, 
-                             (self.x * GRID_SIZE + GRID_SIZE * 2 // 3, eye_y + eye_offset), 
+            pygame.draw.circle(surface, BLACK, 
+                             (ox + GRID_SIZE * 2 // 3, eye_y + eye_offset), 
                              eye_size // 2)
             
             # Mouth
-            mouth_y = self.y * GRID_SIZE + GRID_SIZE * 2 // 3
-            pygame.draw.arc(screen, BLACK, 
-                          (self.x * GRID_SIZE + GRID_SIZE // 4, mouth_y, 
+            mouth_y = oy + GRID_SIZE * 2 // 3
+            pygame.draw.arc(surface, BLACK, 
+                          (ox + GRID_SIZE // 4, mouth_y, 
                            GRID_SIZE // 2, GRID_SIZE // 4),
                           0, 3.14, 2)
             
         elif self.monster_type == "ghost":
             # Draw ghost eyes
             eye_size = GRID_SIZE // 8
-            eye_y = self.y * GRID_SIZE + GRID_SIZE // 3
+            eye_y = oy + GRID_SIZE // 3
             
             # Eyes move based on direction
             eye_x_offset = 0
@@ -341,32 +653,32 @@ class Enemy:
                 eye_y_offset = -2
             
             # Left eye
-            pygame.draw.circle(screen, WHITE, 
-                             (self.x * GRID_SIZE + GRID_SIZE // 3 + eye_x_offset, 
+            pygame.draw.circle(surface, WHITE, 
+                             (ox + GRID_SIZE // 3 + eye_x_offset, 
                               eye_y + eye_y_offset), 
                              eye_size)
-            pygame.draw.circle(screen, BLACK, 
-                             (self.x * GRID_SIZE + GRID_SIZE // 3 + eye_x_offset, 
+            pygame.draw.circle(surface, BLACK, 
+                             (ox + GRID_SIZE // 3 + eye_x_offset, 
                               eye_y + eye_y_offset), 
                              eye_size // 2)
             
             # Right eye
-            pygame.draw.circle(screen, WHITE, 
-                             (self.x * GRID_SIZE + GRID_SIZE * 2 // 3 + eye_x_offset, 
+            pygame.draw.circle(surface, WHITE, 
+                             (ox + GRID_SIZE * 2 // 3 + eye_x_offset, 
                               eye_y + eye_y_offset), 
                              eye_size)
-            pygame.draw.circle(screen, BLACK, 
-                             (self.x * GRID_SIZE + GRID_SIZE * 2 // 3 + eye_x_offset, 
+            pygame.draw.circle(surface, BLACK, 
+                             (ox + GRID_SIZE * 2 // 3 + eye_x_offset, 
                               eye_y + eye_y_offset), 
                              eye_size // 2)
             
             # Ghost bottom edge (wavy)
-            bottom_y = self.y * GRID_SIZE + GRID_SIZE - 5
+            bottom_y = oy + GRID_SIZE - 5
             wave_height = 3 + self.animation_frame % 2 * 2
             
             for i in range(3):
-                pygame.draw.arc(screen, color,
-                              (self.x * GRID_SIZE + 5 + i * (GRID_SIZE - 10) // 3,
+                pygame.draw.arc(surface, color,
+                              (ox + 5 + i * (GRID_SIZE - 10) // 3,
                                bottom_y - wave_height,
                                (GRID_SIZE - 10) // 3, wave_height * 2),
                               3.14, 2 * 3.14, 2)
@@ -374,224 +686,285 @@ class Enemy:
         elif self.monster_type == "goblin":
             # Draw goblin eyes
             eye_size = GRID_SIZE // 8
-            eye_y = self.y * GRID_SIZE + GRID_SIZE // 3
+            eye_y = oy + GRID_SIZE // 3
             
             # Angry eyes
-            pygame.draw.circle(screen, WHITE, 
-                             (self.x * GRID_SIZE + GRID_SIZE // 3, eye_y), 
+            pygame.draw.circle(surface, WHITE, 
+                             (ox + GRID_SIZE // 3, eye_y), 
                              eye_size)
-            pygame.draw.circle(screen, BLACK, 
-                             (self.x * GRID_SIZE + GRID_SIZE // 3, eye_y), 
+            pygame.draw.circle(surface, BLACK, 
+                             (ox + GRID_SIZE // 3, eye_y), 
                              eye_size // 2)
             
-            pygame.draw.circle(screen, WHITE, 
-                             (self.x * GRID_SIZE + GRID_SIZE * 2 // 3, eye_y), 
+            pygame.draw.circle(surface, WHITE, 
+                             (ox + GRID_SIZE * 2 // 3, eye_y), 
                              eye_size)
-            pygame.draw.circle(screen, BLACK, 
-                             (self.x * GRID_SIZE + GRID_SIZE * 2 // 3, eye_y), 
+            pygame.draw.circle(surface, BLACK, 
+                             (ox + GRID_SIZE * 2 // 3, eye_y), 
                              eye_size // 2)
             
             # Eyebrows
-            eyebrow_y = self.y * GRID_SIZE + GRID_SIZE // 4
-            pygame.draw.line(screen, BLACK,
-                           (self.x * GRID_SIZE + GRID_SIZE // 4, eyebrow_y),
-                           (self.x * GRID_SIZE + GRID_SIZE // 2 - 2, eyebrow_y - 3),
+            eyebrow_y = oy + GRID_SIZE // 4
+            pygame.draw.line(surface, BLACK,
+                           (ox + GRID_SIZE // 4, eyebrow_y),
+                           (ox + GRID_SIZE // 2 - 2, eyebrow_y - 3),
                            2)
-            pygame.draw.line(screen, BLACK,
-                           (self.x * GRID_SIZE + GRID_SIZE // 2 + 2, eyebrow_y - 3),
-                           (self.x * GRID_SIZE + GRID_SIZE * 3 // 4, eyebrow_y),
+            pygame.draw.line(surface, BLACK,
+                           (ox + GRID_SIZE // 2 + 2, eyebrow_y - 3),
+                           (ox + GRID_SIZE * 3 // 4, eyebrow_y),
                            2)
             
             # Mouth with teeth
-            mouth_y = self.y * GRID_SIZE + GRID_SIZE * 2 // 3
-            pygame.draw.rect(screen, BLACK,
-                           (self.x * GRID_SIZE + GRID_SIZE // 3,
+            mouth_y = oy + GRID_SIZE * 2 // 3
+            pygame.draw.rect(surface, BLACK,
+                           (ox + GRID_SIZE // 3,
                             mouth_y,
                             GRID_SIZE // 3,
                             GRID_SIZE // 6))
             
             # Teeth (alternating based on animation frame)
             if self.animation_frame % 2 == 0:
-                pygame.draw.rect(screen, WHITE,
-                               (self.x * GRID_SIZE + GRID_SIZE // 3 + 2,
+                pygame.draw.rect(surface, WHITE,
+                               (ox + GRID_SIZE // 3 + 2,
                                 mouth_y + 2,
                                 GRID_SIZE // 10,
                                 GRID_SIZE // 10))
-                pygame.draw.rect(screen, WHITE,
-                               (self.x * GRID_SIZE + GRID_SIZE // 2 + 2,
+                pygame.draw.rect(surface, WHITE,
+                               (ox + GRID_SIZE // 2 + 2,
                                 mouth_y + 2,
                                 GRID_SIZE // 10,
                                 GRID_SIZE // 10))
             else:
-                pygame.draw.rect(screen, WHITE,
-                               (self.x * GRID_SIZE + GRID_SIZE // 3 + GRID_SIZE // 8,
+                pygame.draw.rect(surface, WHITE,
+                               (ox + GRID_SIZE // 3 + GRID_SIZE // 8,
                                 mouth_y + 2,
                                 GRID_SIZE // 10,
                                 GRID_SIZE // 10))
-                pygame.draw.rect(screen, WHITE,
-                               (self.x * GRID_SIZE + GRID_SIZE // 2 - GRID_SIZE // 8,
+                pygame.draw.rect(surface, WHITE,
+                               (ox + GRID_SIZE // 2 - GRID_SIZE // 8,
                                 mouth_y + 2,
                                 GRID_SIZE // 10,
                                 GRID_SIZE // 10))
+            
+        elif self.monster_type == HUNTER:
+            # Draw hunter horns
+            pygame.draw.polygon(surface, BLACK,
+                              [(ox + 8, oy + 5), (ox + 16, oy + 5), (ox + 9, oy - 5)])
+            pygame.draw.polygon(surface, BLACK,
+                              [(ox + GRID_SIZE - 16, oy + 5), (ox + GRID_SIZE - 8, oy + 5),
+                               (ox + GRID_SIZE - 9, oy - 5)])
+            
+            # Glowing eyes that look where the hunter is heading
+            eye_size = GRID_SIZE // 8
+            eye_y = oy + GRID_SIZE // 3
+            pupil_x = self.direction[0] * 2
+            pupil_y = self.direction[1] * 2
+            
+            for eye_x in (ox + GRID_SIZE // 3, ox + GRID_SIZE * 2 // 3):
+                pygame.draw.circle(surface, (255, 220, 0), (eye_x, eye_y), eye_size)
+                pygame.draw.circle(surface, BLACK,
+                                 (eye_x + pupil_x, eye_y + pupil_y),
+                                 eye_size // 2)
+            
+            # Jagged mouth, opening and closing with the animation frame
+            mouth_y = oy + GRID_SIZE * 2 // 3
+            bite = 3 if self.animation_frame % 2 == 0 else 5
+            points = []
+            for i in range(5):
+                points.append((ox + GRID_SIZE // 4 + i * GRID_SIZE // 8,
+                               mouth_y + (bite if i % 2 else 0)))
+            pygame.draw.lines(surface, WHITE, False, points, 2)
 
 class Bomb:
-    def __init__(self, x, y):
+    __slots__ = ("x", "y", "clock", "placed_at", "detonate_at", "exploded", "explosion_range")
+    
+    def __init__(self, x, y, clock):
         self.x = x
         self.y = y
-        self.timer = 90  # 3 seconds at 30 FPS
+        self.clock = clock
+        # Placing counts as the first tick of the fuse, like in the old
+        # frame-counting loop
+        self.placed_at = clock.tick - 1
+        self.detonate_at = self.placed_at + BOMB_FUSE  # 3 seconds at 30 ticks/sec
         self.exploded = False
-        self.explosion_range = 2
-        self.pulse_size = 0
-        self.growing = True
-        self.flash_timer = 0
-        self.flash_state = False
+        self.explosion_range = BOMB_RANGE
     
-    def update(self):
-        if not self.exploded:
-            self.timer -= 1
-            
-            # Animate bomb pulsing
-            if self.growing:
-                self.pulse_size += 0.5
-                if self.pulse_size >= 5:
-                    self.growing = False
-            else:
-                self.pulse_size -= 0.5
-                if self.pulse_size <= 0:
-                    self.growing = True
-            
-            # Flash faster as timer gets lower
-            self.flash_timer += 1
-            flash_speed = 15
-            if self.timer < 30:  # Last second
-                flash_speed = 5
-            elif self.timer < 60:  # Second to last second
-                flash_speed = 10
-                
-            if self.flash_timer >= flash_speed:
-                self.flash_timer = 0
-                self.flash_state = not self.flash_state
-            
-            if self.timer <= 0:
-                self.exploded = True
-                if has_sound:
-                    sound_explosion.play()
-                return True
-        return False
+    def pack(self):
+        return (self.x, self.y, self.placed_at, self.detonate_at, self.exploded, self.explosion_range)
+    
+    def unpack(self, fields, clock):
+        self.x, self.y, self.placed_at, self.detonate_at, exploded, self.explosion_range = fields
+        self.clock = clock
+        self.exploded = bool(exploded)
+    
+    # The animation is a function of the bomb's age, so nothing has to be
+    # updated on ticks where the bomb just sits there
+    @property
+    def timer(self):
+        return self.detonate_at - self.clock.tick
     
-    def draw(self):
+    @property
+    def pulse_size(self):
+        # Grows by 0.5 per tick up to 5, then shrinks back to 0
+        phase = (self.clock.tick - self.placed_at) % 20
+        return phase * 0.5 if phase <= 10 else (20 - phase) * 0.5
+    
+    @property
+    def flash_state(self):
+        # Toggles every 15 ticks, then every 10 in the second to last second
+        # and every 5 in the last second
+        age = self.clock.tick - self.placed_at
+        toggles = (min(age, 30) // 15 + max(0, min(age, 60) - 30) // 10 +
+                   max(0, age - 60) // 5)
+        return toggles % 2 == 1
+    
+    def sprite_key(self):
+        countdown = (self.timer // 3) + 1 if self.timer < 30 else None
+        return ("bomb", self.pulse_size, self.flash_state, countdown)
+    
+    def draw(self, x, y):
         if not self.exploded:
-            center_x = self.x * GRID_SIZE + GRID_SIZE // 2
-            center_y = self.y * GRID_SIZE + GRID_SIZE // 2
-            bomb_radius = GRID_SIZE // 3
-            
-            # Draw bomb body (slightly oval)
-            pygame.draw.ellipse(screen, BLACK, 
-                              (center_x - bomb_radius, 
-                               center_y - bomb_radius,
-                               bomb_radius * 2,
-                               bomb_radius * 2 + 5))
-            
-            # Draw bomb cap (top part)
-            cap_width = bomb_radius // 2
-            pygame.draw.rect(screen, GRAY,
-                           (center_x - cap_width // 2,
-                            center_y - bomb_radius - 5,
-                            cap_width,
-                            5))
-            
-            # Draw bomb fuse
-            fuse_start_x = center_x
-            fuse_start_y = center_y - bomb_radius - 3
+            draw_sprite(self.sprite_key(), self.render, x, y)
+    
+    def render(self, surface, ox, oy):
+        center_x = ox + GRID_SIZE // 2
+        center_y = oy + GRID_SIZE // 2
+        bomb_radius = GRID_SIZE // 3
+        
+        # Draw bomb body (slightly oval)
+        pygame.draw.ellipse(surface, BLACK, 
+                          (center_x - bomb_radius, 
+                           center_y - bomb_radius,
+                           bomb_radius * 2,
+                           bomb_radius * 2 + 5))
+        
+        # Draw bomb cap (top part)
+        cap_width = bomb_radius // 2
+        pygame.draw.rect(surface, GRAY,
+                       (center_x - cap_width // 2,
+                        center_y - bomb_radius - 5,
+                        cap_width,
+                        5))
+        
+        # Draw bomb fuse
+        fuse_start_x = center_x
+        fuse_start_y = center_y - bomb_radius - 3
+        
+        # Wavy fuse line
+        fuse_segments = 4
+        fuse_height = 12
+        prev_x, prev_y = fuse_start_x, fuse_start_y
+        
+        for i in range(1, fuse_segments + 1):
+            next_x = fuse_start_x + (i % 2) * 4 - 2
+            next_y = fuse_start_y - (i * fuse_height / fuse_segments)
+            pygame.draw.line(surface, BROWN, (prev_x, prev_y), (next_x, next_y), 3)
+            prev_x, prev_y = next_x, next_y
+        
+        # Draw fuse spark (flashing)
+        if self.flash_state:
+            spark_color = RED
+        else:
+            spark_color = ORANGE
             
-            # Wavy fuse line
-            fuse_segments = 4
-            fuse_height = 12
-            prev_x, prev_y = fuse_start_x, fuse_start_y
+        pygame.draw.circle(surface, spark_color, 
+                         (prev_x, prev_y - 3), 
+                         3 + self.pulse_size)
+        
+        # Draw bomb highlight (reflection)
+        pygame.draw.ellipse(surface, WHITE, 
+                          (center_x - bomb_radius + 5, 
+                           center_y - bomb_radius + 5,
+                           bomb_radius - 2,
+                           bomb_radius - 2))
+        
+        # Draw "BOMB" text or timer numbers
+        if self.timer < 30:  # Show countdown in last second
+            text = render_text(20, str((self.timer // 3) + 1), WHITE)
+            surface.blit(text, (center_x - text.get_width() // 2, 
+                              center_y - text.get_height() // 2))
+
+def blast_tiles(grid, x, y, blast_range):
+    # Tiles a blast at (x, y) covers, without touching the grid
+    tiles = [(x, y)]  # Center tile
+    
+    # Check in four directions
+    for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        for r in range(1, blast_range + 1):
+            nx, ny = x + dx * r, y + dy * r
             
-            for i in range(1, fuse_segments + 1):
-                next_x = fuse_start_x + (i % 2) * 4 - 2
-                next_y = fuse_start_y - (i * fuse_height / fuse_segments)
-                pygame.draw.line(screen, BROWN, (prev_x, prev_y), (next_x, next_y), 3)
-                prev_x, prev_y = next_x, next_y
+            # Check if out of bounds
+            if not grid.in_bounds(nx, ny):
+                break
             
-            # Draw fuse spark (flashing)
-            if self.flash_state:
-                spark_color = RED
-            else:
-                spark_color = ORANGE
-                
-            pygame.draw.circle(screen, spark_color, 
-                             (prev_x, prev_y - 3), 
-                             3 + self.pulse_size)
+            # If hit a wall, stop in this direction
+            tile = grid.get(nx, ny)
+            if tile == WALL:
+                break
             
-            # Draw bomb highlight (reflection)
-            pygame.draw.ellipse(screen, WHITE, 
-                              (center_x - bomb_radius + 5, 
-                               center_y - bomb_radius + 5,
-                               bomb_radius - 2,
-                               bomb_radius - 2))
+            # Add this tile to explosion
+            tiles.append((nx, ny))
             
-            # Draw "BOMB" text or timer numbers
-            if self.timer < 30:  # Show countdown in last second
-                font = pygame.font.SysFont(None, 20)
-                text = font.render(str((self.timer // 3) + 1), True, WHITE)
-                screen.blit(text, (center_x - text.get_width() // 2, 
-                                  center_y - text.get_height() // 2))
+            # If hit a destructible block, it takes the blast and stops it
+            if tile == BLOCK:
+                break
+    
+    return tiles
 
 class Explosion:
-    def __init__(self, x, y, range_val, grid):
+    __slots__ = ("x", "y", "range", "clock", "started_at", "expire_at", "destroyed", "tiles", "animation_speed")
+    
+    def __init__(self, x, y, range_val, grid, clock):
         self.x = x
         self.y = y
         self.range = range_val
-        self.timer = 30  # 1 second at 30 FPS
+        self.clock = clock
+        self.started_at = clock.tick - 1
+        self.expire_at = self.started_at + EXPLOSION_TICKS  # 1 second at 30 ticks/sec
+        self.destroyed = []
         self.tiles = self.calculate_tiles(grid)
-        self.animation_frame = 0
         self.animation_speed = 3
     
     def calculate_tiles(self, grid):
-        tiles = [(self.x, self.y)]  # Center tile
-        
-        # Check in four directions
-        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-            for r in range(1, self.range + 1):
-                nx, ny = self.x + dx * r, self.y + dy * r
-                
-                # Check if out of bounds
-                if not (0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT):
-                    break
-                
-                # If hit a wall, stop in this direction
-                if grid[ny][nx] == 1:
-                    break
-                
-                # Add this tile to explosion
-                tiles.append((nx, ny))
-                
-                # If hit a destructible block, destroy it and stop
-                if grid[ny][nx] == 2:
-                    grid[ny][nx] = 0
-                    break
+        tiles = blast_tiles(grid, self.x, self.y, self.range)
         
+        # Destructible blocks stop the blast and are destroyed by it
+        self.destroyed = grid.destroy(tiles)
         return tiles
     
-    def update(self):
-        self.timer -= 1
-        # Update animation frame
-        if self.timer % self.animation_speed == 0:
-            self.animation_frame = (self.animation_frame + 1) % 3
-        return self.timer <= 0
+    @property
+    def animation_frame(self):
+        return (self.clock.tick - self.started_at) // self.animation_speed % 3
+    
+    # The tiles are packed separately since their number varies
+    def pack(self):
+        return (self.x, self.y, self.range, self.started_at, self.expire_at,
+                self.animation_speed, len(self.tiles))
     
-    def draw(self):
+    def unpack(self, fields, clock, tiles):
+        self.x, self.y, self.range, self.started_at, self.expire_at, self.animation_speed, _ = fields
+        self.clock = clock
+        self.tiles = tiles
+        self.destroyed = []
+    
+    def draw(self, rng=random, camera=None):
+        # Only the tiles the camera sees are drawn, shifted by its offset.
+        # Returns the number of draw calls, for the profiler.
+        left, top = (camera.left, camera.top) if camera else (0, 0)
+        calls = 0
         for x, y in self.tiles:
+            if camera and not camera.sees(x, y):
+                continue
+            
             # Base explosion
             pygame.draw.rect(screen, RED, 
-                           (x * GRID_SIZE, y * GRID_SIZE, 
+                           (x * GRID_SIZE - left, y * GRID_SIZE - top, 
                             GRID_SIZE, GRID_SIZE))
+            calls += 1
             
             # Add explosion details based on animation frame
-            center_x = x * GRID_SIZE + GRID_SIZE // 2
-            center_y = y * GRID_SIZE + GRID_SIZE // 2
+            center_x = x * GRID_SIZE - left + GRID_SIZE // 2
+            center_y = y * GRID_SIZE - top + GRID_SIZE // 2
             
             # Draw explosion waves
             wave_colors = [(255, 200, 0), (255, 150, 0), (255, 100, 0)]
@@ -599,513 +972,1900 @@ class Explosion:
                 size = GRID_SIZE // 2 - i * 5 - self.animation_frame * 2
                 if size > 0:
                     pygame.draw.circle(screen, color, (center_x, center_y), size)
+                    calls += 1
             
             # Draw sparks
             spark_count = 5 + self.animation_frame * 2
             for _ in range(spark_count):
-                angle = random.random() * 6.28  # 2*pi
-                distance = random.random() * GRID_SIZE // 3
+                angle = rng.random() * 6.28  # 2*pi
+                distance = rng.random() * GRID_SIZE // 3
                 spark_x = center_x + int(math.cos(angle) * distance)
                 spark_y = center_y + int(math.sin(angle) * distance)
-                spark_size = random.randint(1, 3)
+                spark_size = rng.randint(1, 3)
                 pygame.draw.circle(screen, (255, 255, 200), 
                                  (spark_x, spark_y), spark_size)
+            calls += spark_count
+        return calls
 
-def create_grid():
-    # 0 = empty, 1 = wall (indestructible), 2 = block (destructible)
-    grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+class Grid:
+    # Map tiles stored row by row in a single bytearray. grid[y][x] still
+    # works (each row is a memoryview slice) and, when NumPy is installed,
+    # grid.array is a zero-copy uint8 view of the same memory that the
+    # whole-grid helpers use instead of looping over cells in Python. The
+    # view is only made (and NumPy imported) the first time it is used.
+    def __init__(self, width, height, fill=EMPTY):
+        self.width = width
+        self.height = height
+        self.cells = bytearray([fill]) * (width * height)
+        self._bind()
     
-    # Add walls around the edges
-    for x in range(GRID_WIDTH):
-        grid[0][x] = 1
-        grid[GRID_HEIGHT-1][x] = 1
+    def _bind(self):
+        view = memoryview(self.cells)
+        self.rows = [view[y * self.width:(y + 1) * self.width] for y in range(self.height)]
+        self._array = None
     
-    for y in range(GRID_HEIGHT):
-        grid[y][0] = 1
-        grid[y][GRID_WIDTH-1] = 1
+    @property
+    def array(self):
+        if self._array is None and np is not None:
+            self._array = np.frombuffer(self.cells, dtype=np.uint8).reshape(self.height, self.width)
+        return self._array
     
-    # Add walls in a grid pattern
-    for y in range(2, GRID_HEIGHT - 2, 2):
-        for x in range(2, GRID_WIDTH - 2, 2):
-            grid[y][x] = 1
+    def __getitem__(self, y):
+        return self.rows[y]
+    
+    def __len__(self):
+        return self.height
+    
+    def __iter__(self):
+        return iter(self.rows)
+    
+    # memoryviews can't be pickled, so only the raw tiles are sent across
+    def __getstate__(self):
+        return self.width, self.height, bytes(self.cells)
+    
+    def __setstate__(self, state):
+        self.width, self.height, cells = state
+        self.cells = bytearray(cells)
+        self._bind()
+    
+    def copy(self):
+        grid = Grid.__new__(Grid)
+        grid.__setstate__(self.__getstate__())
+        return grid
+    
+    def tolist(self):
+        return [list(row) for row in self.rows]
+    
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+    
+    def get(self, x, y):
+        return self.cells[y * self.width + x]
     
-    # Add random destructible blocks
-    for y in range(1, GRID_HEIGHT - 1):
-        for x in range(1, GRID_WIDTH - 1):
-            if grid[y][x] == 0 and random.random() < 0.3:
-                # Keep the player's starting area clear
-                if not (x < 3 and y < 3):
-                    grid[y][x] = 2
+    def set(self, x, y, tile):
+        self.cells[y * self.width + x] = tile
     
-    # Ensure player starting position is clear
-    grid[1][1] = 0
+    def is_walkable(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and self.cells[y * self.width + x] == EMPTY
     
-    return grid
+    def region(self, left, top, right, bottom):
+        # The tiles of a rectangle (right and bottom excluded) as bytes, row
+        # by row, to compare a part of the map without copying all of it
+        if self.array is not None:
+            return self.array[top:bottom, left:right].tobytes()
+        return b"".join(row[left:right] for row in self.rows[top:bottom])
+    
+    def walkable_mask(self):
+        # Boolean (height, width) array of empty tiles
+        if self.array is not None:
+            return self.array == EMPTY
+        return [[tile == EMPTY for tile in row] for row in self.rows]
+    
+    def free_cells(self):
+        # All empty tiles as (x, y), in row-major order
+        if self.array is not None:
+            ys, xs = np.nonzero(self.array == EMPTY)
+            return list(zip(xs.tolist(), ys.tolist()))
+        width = self.width
+        return [(i % width, i // width) for i, tile in enumerate(self.cells) if tile == EMPTY]
+    
+    def count(self, tile):
+        # bytearray.count runs in C, no NumPy needed
+        return self.cells.count(tile)
+    
+    def block_counts(self):
+        return {tile: self.cells.count(tile) for tile in (EMPTY, WALL, BLOCK)}
+    
+    def destroy(self, tiles):
+        # Turn every destructible block among tiles into an empty tile and
+        # return the ones that were destroyed
+        if len(tiles) > 16 and self.array is not None:
+            coords = np.asarray(list(dict.fromkeys(tiles)), dtype=np.intp)
+            xs, ys = coords[:, 0], coords[:, 1]
+            hit = self.array[ys, xs] == BLOCK
+            xs, ys = xs[hit], ys[hit]
+            self.array[ys, xs] = EMPTY
+            return list(zip(xs.tolist(), ys.tolist()))
+        destroyed = []
+        for x, y in tiles:
+            if self.cells[y * self.width + x] == BLOCK:
+                self.cells[y * self.width + x] = EMPTY
+                destroyed.append((x, y))
+        return destroyed
 
-def spawn_enemies(grid, num_enemies):
-    enemies = []
-    for _ in range(num_enemies):
-        # Find a random empty cell for the enemy
+class ExplosionMap:
+    # Number of live explosions covering each tile, kept up to date as
+    # explosions start and expire, so "is (x, y) burning?" is one lookup
+    # instead of a scan over every explosion's tiles
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.counts = array("H", bytes(2 * width * height))
+    
+    def add(self, explosion):
+        counts = self.counts
+        width = self.width
+        for x, y in explosion.tiles:
+            counts[y * width + x] += 1
+    
+    def remove(self, explosion):
+        counts = self.counts
+        width = self.width
+        for x, y in explosion.tiles:
+            counts[y * width + x] -= 1
+    
+    def is_burning(self, x, y):
+        return self.counts[y * self.width + x] > 0
+
+class SpatialIndex:
+    # Number of live entities on each tile, kept up to date as they spawn,
+    # move and die, so "is anyone on (x, y)?" is one lookup instead of a
+    # scan over every entity. The index doesn't watch its entities: whoever
+    # moves one tells it where the entity came from.
+    def __init__(self, width, height, entities=()):
+        self.width = width
+        self.height = height
+        self.counts = array("H", bytes(2 * width * height))
+        for entity in entities:
+            self.add(entity)
+    
+    def add(self, entity):
+        self.counts[entity.y * self.width + entity.x] += 1
+    
+    def remove(self, entity):
+        self.counts[entity.y * self.width + entity.x] -= 1
+    
+    def move(self, entity, x, y):
+        # Entity stepped from (x, y) to where it is now
+        counts = self.counts
+        width = self.width
+        counts[y * width + x] -= 1
+        counts[entity.y * width + entity.x] += 1
+    
+    def count(self, x, y):
+        return self.counts[y * self.width + x]
+    
+    def is_occupied(self, x, y):
+        return self.counts[y * self.width + x] > 0
+
+# Kinds of scheduled events
+EVENT_RESPAWN = "respawn"
+EVENT_DETONATE = "detonate"
+EVENT_EXPIRE = "expire"
+EVENT_ENEMY_MOVE = "enemy_move"
+EVENT_NEXT_LEVEL = "next_level"
+
+class Scheduler:
+    # Game clock plus one heap of (tick, sequence, target) per event kind.
+    # Entities register the tick at which something happens to them, so an
+    # entity costs nothing on ticks where nothing happens. Events whose
+    # target has gone in the meantime (say a bomb set off early by a chain
+    # reaction) are skipped by whoever pops them.
+    def __init__(self, tick=0):
+        self.tick = tick
+        self.queues = {}
+        self.count = 0
+    
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+    
+    def schedule(self, tick, kind, target=None):
+        self.count += 1
+        heapq.heappush(self.queues.setdefault(kind, []), (tick, self.count, target))
+    
+    def pop_due(self, kind):
+        # Targets of every event of this kind due at or before the current tick,
+        # in the order they were scheduled
+        queue = self.queues.get(kind)
+        due = []
+        while queue and queue[0][0] <= self.tick:
+            due.append(heapq.heappop(queue)[2])
+        return due
+    
+    def clear(self):
+        self.queues.clear()
+
+# burn_at value of tiles no bomb is going to reach
+NEVER = 2 ** 62
+
+class DangerMap:
+    # Predicts when each tile will be hit by the bombs already on the map,
+    # chain reactions included, without simulating anything. It is updated
+    # incrementally when a bomb is placed or goes off and when blocks are
+    # destroyed (which lets blasts reach further), so asking about a tile is
+    # a single array lookup. A block that another blast breaks no later than
+    # a bomb goes off doesn't stop that bomb's blast: on the same tick the
+    # block may still be standing, but for a danger map it is safer to say
+    # too much than too little.
+    def __init__(self, grid, clock, fire):
+        self.grid = grid
+        self.clock = clock
+        self.fire = fire
+        self.width = grid.width
+        self.burn_at = array("q", [NEVER]) * (grid.width * grid.height)
+        self.fuses = {}     # Bomb -> tick it goes off, chain reactions included
+        self.blasts = {}    # Bomb -> tile indices its blast will cover
+        self.covering = {}  # Tile index -> bombs whose blast covers it
+        self.bomb_at = {}   # Tile index -> Bomb
+    
+    def time_until_burn(self, x, y):
+        # Ticks until (x, y) burns: 0 if it is burning now, None if no bomb
+        # on the map will reach it
+        if self.fire.is_burning(x, y):
+            return 0
+        burn_at = self.burn_at[y * self.width + x]
+        if burn_at == NEVER:
+            return None
+        return max(0, burn_at - self.clock.tick)
+    
+    def is_safe(self, x, y, within=0):
+        # Whether (x, y) stays clear of blasts for the next `within` ticks
+        ticks = self.time_until_burn(x, y)
+        return ticks is None or ticks > within
+    
+    def pack(self, bombs):
+        # The predictions for these bombs (all the ones on the map) in their
+        # order, for GameState.snapshot()
+        blasts = self.blasts
+        return (self.burn_at[:],
+                array("q", [self.fuses[bomb] for bomb in bombs]),
+                array("q", [len(blasts[bomb]) for bomb in bombs]),
+                array("q", [index for bomb in bombs for index in blasts[bomb]]))
+    
+    def unpack(self, fields, bombs):
+        burn_at, fuses, sizes, blasts = fields
+        self.burn_at = burn_at[:]
+        covering = self.covering
+        start = 0
+        for bomb, fuse, size in zip(bombs, fuses, sizes):
+            blast = blasts[start:start + size].tolist()
+            start += size
+            self.fuses[bomb] = fuse
+            self.blasts[bomb] = blast
+            self.bomb_at[bomb.y * self.width + bomb.x] = bomb
+            for index in blast:
+                covering.setdefault(index, []).append(bomb)
+    
+    def predict(self, bomb):
+        # Like blast_tiles(), looking through the blocks broken in time
+        grid = self.grid
+        width = self.width
+        fuses = self.fuses
+        covering = self.covering
+        fuse = fuses[bomb]
+        tiles = [bomb.y * width + bomb.x]
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            for r in range(1, bomb.explosion_range + 1):
+                x, y = bomb.x + dx * r, bomb.y + dy * r
+                if not grid.in_bounds(x, y):
+                    break
+                tile = grid.get(x, y)
+                if tile == WALL:
+                    break
+                index = y * width + x
+                tiles.append(index)
+                if tile == BLOCK and not any(other is not bomb and fuses[other] <= fuse
+                                             for other in covering.get(index, ())):
+                    break
+        return tiles
+    
+    def add_bomb(self, bomb):
+        index = bomb.y * self.width + bomb.x
+        self.bomb_at[index] = bomb
+        
+        # A bomb in the path of one going off sooner goes off with it
+        fuse = bomb.detonate_at
+        for other in self.covering.get(index, ()):
+            fuse = min(fuse, self.fuses[other])
+        self.fuses[bomb] = fuse
+        self.spread([bomb])
+    
+    def remove_bomb(self, bomb):
+        if self.fuses.pop(bomb, None) is None:
+            return
+        del self.bomb_at[bomb.y * self.width + bomb.x]
+        
+        # Its tiles now only burn when the remaining bombs say so
+        burn_at = self.burn_at
+        for index in self.blasts.pop(bomb):
+            covering = self.covering[index]
+            covering.remove(bomb)
+            if covering:
+                burn_at[index] = min(self.fuses[other] for other in covering)
+            else:
+                del self.covering[index]
+                burn_at[index] = NEVER
+    
+    def blocks_destroyed(self, tiles):
+        # Blasts that were stopped by these blocks can now reach further.
+        # Blasts only ever grow, so fuses and burn times only move earlier.
+        width = self.width
+        affected = []
+        for x, y in tiles:
+            for bomb in self.covering.get(y * width + x, ()):
+                if bomb not in affected:
+                    affected.append(bomb)
+        self.spread(affected)
+    
+    def grow_blast(self, bomb):
+        # Add the tiles the bomb's blast reaches now to the ones it covered,
+        # and return whether there were any
+        blast = self.blasts.setdefault(bomb, [])
+        old = set(blast)
+        grown = False
+        for index in self.predict(bomb):
+            if index not in old:
+                blast.append(index)
+                self.covering.setdefault(index, []).append(bomb)
+                grown = True
+        return grown
+    
+    def spread(self, bombs):
+        # Push each bomb's fuse onto the tiles it covers and to the bombs it
+        # sets off early, following the chain as far as it goes. A bomb going
+        # off earlier can also break a block in time for another blast that
+        # it stopped until then.
+        burn_at = self.burn_at
+        fuses = self.fuses
+        bomb_at = self.bomb_at
+        cells = self.grid.cells
+        stack = list(bombs)
+        while stack:
+            bomb = stack.pop()
+            fuse = fuses[bomb]
+            self.grow_blast(bomb)
+            for index in self.blasts[bomb]:
+                if fuse < burn_at[index]:
+                    burn_at[index] = fuse
+                other = bomb_at.get(index)
+                if other is not None and fuses[other] > fuse:
+                    fuses[other] = fuse
+                    stack.append(other)
+                elif cells[index] == BLOCK:
+                    for other in self.covering[index]:
+                        if other is not bomb and fuses[other] >= fuse and self.grow_blast(other):
+                            stack.append(other)
+
+# Neighbour order used when walking the flow field
+FLOW_DIRECTIONS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+
+FLOW_RADIUS = 32  # Steps the flow field reaches, hunters further away wander
+
+class FlowField:
+    # Breadth-first distance from the player to every tile reachable from
+    # it in at most `radius` steps. It is computed at most once per tick and
+    # only when the player has changed tile or the map around them has
+    # changed, and every hunter reads the same field, so chasing costs the
+    # same with one hunter or a hundred, and the same on any size of map.
+    def __init__(self, radius=FLOW_RADIUS):
+        self.radius = radius
+        self.origin = None
+        self.cells = None
+        self.width = 0
+        self.distances = {}
+    
+    def update(self, grid, x, y):
+        # Paths of up to `radius` steps never leave this box
+        radius = self.radius
+        cells = grid.region(max(0, x - radius), max(0, y - radius),
+                            min(grid.width, x + radius + 1), min(grid.height, y + radius + 1))
+        if (x, y) == self.origin and cells == self.cells:
+            return False
+        
+        width = grid.width
+        tiles = grid.cells
+        size = width * grid.height
+        start = y * width + x
+        distances = {start: 0}
+        frontier = [start]
+        for distance in range(1, radius + 1):
+            next_frontier = []
+            for i in frontier:
+                # The outer wall means neighbours never leave the map
+                for n in (i + 1, i - 1, i + width, i - width):
+                    if 0 <= n < size and n not in distances and tiles[n] == EMPTY:
+                        distances[n] = distance
+                        next_frontier.append(n)
+            frontier = next_frontier
+            if not frontier:
+                break
+        
+        self.origin = (x, y)
+        self.cells = cells
+        self.width = width
+        self.distances = distances
+        return True
+    
+    def distance(self, x, y):
+        # Steps to the player, or None if the tile can't reach the player
+        # within the radius
+        return self.distances.get(y * self.width + x)
+
+# Tile -> 1 for the tiles open_pockets() still has to reach
+UNREACHED = bytes(int(tile == EMPTY) for tile in range(256))
+
+def open_pockets(cells, width):
+    # Clear short tunnels through the blocks so that every empty tile of a
+    # map can be walked to from the player's start. `cells` is laid out like
+    # Grid.cells, with the walls and pillars generate_level() puts down.
+    #
+    # A single flood fill marks what the start reaches. Then each pocket it
+    # missed is found by its top left tile (the first one left in the
+    # scan), so the tiles above it and to its left are reached or blocks.
+    # Going up from there, or left when a pillar is in the way, never meets
+    # a wall and ends at a reached tile after a block or two. The blocks on
+    # the way are cleared and a flood fill from the tunnel takes the pocket
+    # in.
+    todo = bytearray(bytes(cells).translate(UNREACHED))
+    up, down = -width, width
+    
+    def flood(stack):
+        push, pop = stack.append, stack.pop
+        for i in stack:
+            todo[i] = 0
+        while stack:
+            i = pop()
+            if todo[i + 1]:
+                todo[i + 1] = 0
+                push(i + 1)
+            if todo[i - 1]:
+                todo[i - 1] = 0
+                push(i - 1)
+            if todo[i + down]:
+                todo[i + down] = 0
+                push(i + down)
+            if todo[i + up]:
+                todo[i + up] = 0
+                push(i + up)
+    
+    flood([PLAYER_START[1] * width + PLAYER_START[0]])
+    i = todo.find(1)
+    while i >= 0:
+        tunnel = [i]
+        j = i
         while True:
-            x = random.randint(1, GRID_WIDTH - 2)
-            y = random.randint(1, GRID_HEIGHT - 2)
-            # Make sure it's empty and not too close to player start
-            if grid[y][x] == 0 and (x > 3 or y > 3):
-                enemies.append(Enemy(x, y))
+            j -= width if j % width % 2 and j >= 2 * width else 1
+            if cells[j] == EMPTY:
                 break
+            cells[j] = EMPTY
+            tunnel.append(j)
+        flood(tunnel)
+        i = todo.find(1, i)
+
+@lru_cache(maxsize=4)
+def tile_coords(width, height):
+    # (x, y) of every tile index of a map
+    return [(i % width, i // width) for i in range(width * height)]
+
+def generate_level(width=GRID_WIDTH, height=GRID_HEIGHT, rng=random):
+    # A new map plus the free-cell index enemies spawn from: every empty
+    # tile away from the player's start, as (x, y). Blocks go down at
+    # random, then open_pockets() makes sure the player can walk to every
+    # empty tile, so no enemy starts walled in.
+    grid = Grid(width, height, EMPTY)
+    cells = grid.cells
+    
+    # Add walls around the edges
+    cells[:width] = cells[-width:] = bytes([WALL]) * width
+    for y in range(height):
+        cells[y * width] = cells[y * width + width - 1] = WALL
+    
+    # Add walls in a grid pattern
+    for y in range(2, height - 2, 2):
+        for x in range(2, width - 2, 2):
+            cells[y * width + x] = WALL
+    
+    # Add random destructible blocks, keeping the player's starting area clear
+    random_value = rng.random
+    for y in range(1, height - 1):
+        row = y * width
+        for x in [x for x in range(1, width - 1) if cells[row + x] == EMPTY and random_value() < 0.3]:
+            if x >= 3 or y >= 3:
+                cells[row + x] = BLOCK
+    
+    open_pockets(cells, width)
+    
+    # The free-cell index, picked out of the tiles by a mask of the empty
+    # ones away from the start
+    empty = bytearray(bytes(cells).translate(UNREACHED))
+    for y in range(1, 4):
+        empty[y * width + 1:y * width + 4] = bytes(3)
+    free = list(compress(tile_coords(width, height), empty))
+    return grid, free
+
+def create_grid(width=GRID_WIDTH, height=GRID_HEIGHT, rng=random):
+    return generate_level(width, height, rng)[0]
+
+def spawn_enemies(grid, num_enemies, clock, monster_types=MONSTER_TYPES, rng=random, free=None):
+    # Enemies on distinct free cells away from the player's start, each
+    # picked in O(1) from the free-cell index (taken from the grid when not
+    # given, and used up). Stops early if the cells run out.
+    if free is None:
+        free = [(x, y) for x, y in grid.free_cells() if x > 3 or y > 3]
+    enemies = []
+    for _ in range(min(num_enemies, len(free))):
+        i = rng.randrange(len(free))
+        x, y = free[i]
+        free[i] = free[-1]
+        free.pop()
+        enemies.append(Enemy(x, y, clock, monster_types, rng))
     return enemies
 
-def draw_grid(grid):
-    for y in range(GRID_HEIGHT):
-        for x in range(GRID_WIDTH):
-            rect = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
-            if grid[y][x] == 0:  # Empty
-                pygame.draw.rect(screen, GREEN, rect)
-            elif grid[y][x] == 1:  # Wall
-                pygame.draw.rect(screen, GRAY, rect)
-            elif grid[y][x] == 2:  # Block
-                pygame.draw.rect(screen, BROWN, rect)
+TILE_COLORS = {
+    EMPTY: GREEN,
+    WALL: GRAY,
+    BLOCK: BROWN,
+}
+
+def draw_tile(surface, grid, x, y, left=0, top=0):
+    # Draws tile (x, y) with the surface's top left corner at pixel (left, top)
+    # of the map
+    rect = pygame.Rect(x * GRID_SIZE - left, y * GRID_SIZE - top, GRID_SIZE, GRID_SIZE)
+    pygame.draw.rect(surface, TILE_COLORS[grid.get(x, y)], rect)
+    return rect
 
 def draw_ui(player):
     # Draw score
-    font = pygame.font.SysFont(None, 36)
-    score_text = font.render(f"Score: {player.score}", True, WHITE)
-    screen.blit(score_text, (10, 10))
+    score_text = render_text(36, f"Score: {player.score}", WHITE)
+    score_rect = screen.blit(score_text, (10, 10))
     
     # Draw lives
-    lives_text = font.render(f"Lives: {player.lives}", True, WHITE)
-    screen.blit(lives_text, (SCREEN_WIDTH - lives_text.get_width() - 10, 10))
+    lives_text = render_text(36, f"Lives: {player.lives}", WHITE)
+    lives_rect = screen.blit(lives_text, (SCREEN_WIDTH - lives_text.get_width() - 10, 10))
+    return [score_rect, lives_rect]
+
+def entity_rect(x, y):
+    # Screen area an entity on tile (x, y) may paint, the same area its
+    # sprite covers. Bomb fuses and the player's antenna reach up into the
+    # tile above.
+    return pygame.Rect((round(x * GRID_SIZE), round(y * GRID_SIZE) - SPRITE_OFFSET), SPRITE_SIZE)
 
-def main():
-    # This function is no longer used, replaced by game_loop
-    pass
+class Camera:
+    # The part of the map on screen: the pixel of the map at the screen's top
+    # left corner. It keeps the player in the middle of the screen, stopping
+    # at the edges of the map, so maps no bigger than the screen never scroll.
+    def __init__(self, width, height):
+        self.width = width  # Screen size in pixels
+        self.height = height
+        self.left = 0
+        self.top = 0
+        self.tiles = (0, 0, 0, 0)
     
-    while running:
-        # Handle events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    player.place_bomb(bombs)
-                    if has_sound:
-                        sound_bomb.play()
-                # Set key_pressed to True when arrow key is pressed
-                elif event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT):
-                    key_pressed = True
-            elif event.type == pygame.KEYUP:
-                # Reset key_pressed when arrow key is released
-                if event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT):
-                    key_pressed = False
-                    move_cooldown = 0
-        
-        # Handle player movement if alive and not respawning
-        if player.alive and respawn_timer <= 0:
-            # Decrease move cooldown
-            if move_cooldown > 0:
-                move_cooldown -= 1
-            
-            # Only move if cooldown is 0 and key is pressed
-            if move_cooldown == 0 and key_pressed:
-                keys = pygame.key.get_pressed()
-                moved = False
-                
-                if keys[pygame.K_UP]:
-                    player.move(0, -player.speed, grid)
-                    moved = True
-                elif keys[pygame.K_DOWN]:
-                    player.move(0, player.speed, grid)
-                    moved = True
-                elif keys[pygame.K_LEFT]:
-                    player.move(-player.speed, 0, grid)
-                    moved = True
-                elif keys[pygame.K_RIGHT]:
-                    player.move(player.speed, 0, grid)
-                    moved = True
-                
-                # Set cooldown after movement
-                if moved:
-                    move_cooldown = 10  # Adjust this value to control movement speed
-            
-            # Update player animation
-            player.update()
-        elif respawn_timer > 0:
-            respawn_timer -= 1
-            if respawn_timer <= 0:
-                # Reset player position
-                player.x = 1
-                player.y = 1
-        
-        # Update bombs
-        for bomb in bombs[:]:
-            if bomb.update():
-                bombs.remove(bomb)
-                explosions.append(Explosion(bomb.x, bomb.y, bomb.explosion_range, grid))
-                player.bombs += 1  # Return the bomb to the player
-        
-        # Update explosions
-        for explosion in explosions[:]:
-            if explosion.update():
-                explosions.remove(explosion)
-            
-            # Check if player is hit by explosion
-            if player.alive and respawn_timer <= 0:
-                for x, y in explosion.tiles:
-                    if player.x == x and player.y == y:
-                        if has_sound:
-                            sound_player_die.play()
-                        if not player.lose_life():
-                            # Game over
-                            if has_sound:
-                                sound_game_over.play()
-                        else:
-                            # Start respawn timer
-                            respawn_timer = 60  # 2 seconds at 30 FPS
-        
-        # Update enemies
-        for enemy in enemies[:]:
-            if enemy.alive:
-                enemy.update(grid, explosions)
-                
-                # Check if player collides with enemy
-                if player.alive and respawn_timer <= 0 and player.x == enemy.x and player.y == enemy.y:
-                    if has_sound:
-                        sound_player_die.play()
-                    if not player.lose_life():
-                        # Game over
-                        if has_sound:
-                            sound_game_over.play()
-                    else:
-                        # Start respawn timer
-                        respawn_timer = 60  # 2 seconds at 30 FPS
-            else:
-                # Enemy killed, add score
-                player.score += 100
-                if has_sound:
-                    sound_enemy_die.play()
-                enemies.remove(enemy)
+    def follow(self, x, y, grid):
+        # Centre on tile position (x, y), which may be between two tiles
+        right = max(0, grid.width * GRID_SIZE - self.width)
+        bottom = max(0, grid.height * GRID_SIZE - self.height)
+        self.left = min(max(round((x + 0.5) * GRID_SIZE - self.width / 2), 0), right)
+        self.top = min(max(round((y + 0.5) * GRID_SIZE - self.height / 2), 0), bottom)
         
-        # Check win condition
-        if not enemies and player.alive:
-            if not win_bonus_added:
-                # Add bonus for completing the level (only once)
-                if player.lives > 0:
-                    player.score += player.lives * 200
-                win_bonus_added = True
-            win = True
-        else:
-            win = False
+        # Tiles on screen, plus the row below whose sprites reach up into it
+        self.tiles = (self.left // GRID_SIZE, self.top // GRID_SIZE,
+                      (self.left + self.width - 1) // GRID_SIZE + 1,
+                      (self.top + self.height - 1) // GRID_SIZE + 2)
+    
+    def sees(self, x, y):
+        # Whether something on tile position (x, y) can show on screen
+        left, top, right, bottom = self.tiles
+        return left - 1 < x < right and top - 1 < y < bottom
+    
+    def to_screen(self, x, y):
+        # Tile position on the map -> tile position on the screen
+        return x - self.left / GRID_SIZE, y - self.top / GRID_SIZE
+
+CHUNK_TILES = 8  # Background chunks are 8x8 tiles
+CHUNK_CACHE_SIZE = 32
+
+class Background:
+    # The tiles pre-rendered in chunks of CHUNK_TILES x CHUNK_TILES. A chunk
+    # is built the first time it comes into view and kept in an LRU, so
+    # memory use and the cost of a frame don't grow with the size of the map.
+    # The chunks in view are put together into `surface`, a copy of the
+    # background under the screen, which is only rebuilt when the camera
+    # moves. Each chunk remembers the tiles it was drawn from, and sync()
+    # repaints only the tiles that changed (blocks destroyed by explosions).
+    def __init__(self, size):
+        self.surface = pygame.Surface(size)
+        self.view = None  # Camera position `surface` was put together for
+        self.grid = None
+        self.chunks = LRUCache(CHUNK_CACHE_SIZE)  # (cx, cy) -> [surface, tiles]
+    
+    def bounds(self, cx, cy):
+        # Tiles of chunk (cx, cy) that are on the map
+        left, top = cx * CHUNK_TILES, cy * CHUNK_TILES
+        return (left, top, min(left + CHUNK_TILES, self.grid.width), min(top + CHUNK_TILES, self.grid.height))
+    
+    def build(self, cx, cy):
+        size = CHUNK_TILES * GRID_SIZE
+        surface = pygame.Surface((size, size))
+        surface.fill(BLACK)
+        left, top, right, bottom = self.bounds(cx, cy)
+        for y in range(top, bottom):
+            for x in range(left, right):
+                draw_tile(surface, self.grid, x, y, cx * size, cy * size)
+        return [surface, self.grid.region(left, top, right, bottom)]
+    
+    def in_view(self, camera):
+        size = CHUNK_TILES * GRID_SIZE
+        for cy in range(camera.top // size, (camera.top + camera.height - 1) // size + 1):
+            for cx in range(camera.left // size, (camera.left + camera.width - 1) // size + 1):
+                yield cx, cy
+    
+    def sync(self, grid, camera):
+        # Bring `surface` up to date with the grid and the camera. Returns
+        # the screen rects of the tiles that changed, or None when
+        # everything did (a new grid, or the camera moved).
+        if grid is not self.grid:
+            self.grid = grid
+            self.chunks.clear()
+            self.view = None
+        
+        size = CHUNK_TILES * GRID_SIZE
+        view = (camera.left, camera.top)
+        if view != self.view:
+            for cx, cy in self.in_view(camera):
+                chunk = self.chunks.get((cx, cy), self.build, cx, cy)
+                self.repaint(chunk, cx, cy)
+                self.surface.blit(chunk[0], (cx * size - camera.left, cy * size - camera.top))
+            self.view = view
+            return None
+        
+        changed = []
+        for cx, cy in self.in_view(camera):
+            chunk = self.chunks.data.get((cx, cy))
+            for x, y in self.repaint(chunk, cx, cy):
+                changed.append(draw_tile(self.surface, grid, x, y, camera.left, camera.top))
+        return changed
+    
+    def repaint(self, chunk, cx, cy):
+        # Redraw the tiles of a chunk that changed since it was drawn, and
+        # return them
+        left, top, right, bottom = self.bounds(cx, cy)
+        tiles = self.grid.region(left, top, right, bottom)
+        if tiles == chunk[1]:
+            return []
+        size = CHUNK_TILES * GRID_SIZE
+        width = right - left
+        changed = []
+        for i, (a, b) in enumerate(zip(tiles, chunk[1])):
+            if a != b:
+                changed.append((left + i % width, top + i // width))
+                draw_tile(chunk[0], self.grid, *changed[-1], cx * size, cy * size)
+        chunk[1] = tiles
+        return changed
+
+class Renderer:
+    # Draws a GameState over the cached Background and only pushes the
+    # regions that changed since the last frame to the display.
+    #
+    # Frames can come faster than ticks. remember() is called before every
+    # tick, and draw() then slides the player and enemies from where they
+    # stood to where the tick put them, `alpha` of the way (the fraction of
+    # the next tick that has already gone by).
+    #
+    # Maps bigger than the screen scroll with the player. Only what the
+    # camera sees is drawn, and the whole screen is redrawn on frames where
+    # it moved.
+    #
+    # With a Profiler, every part of the frame is timed and its draw calls
+    # counted, and the profiler's overlay is drawn on top when it's shown.
+    def __init__(self, surface, profiler=None):
+        self.surface = surface
+        self.background = Background(surface.get_size())
+        self.camera = Camera(*surface.get_size())
+        self.previous = []
+        self.full_redraw = True
+        self.positions = {}  # Entity -> tile it stood on before the last tick
+        self.profiler = profiler
+        self.prepared = None  # Background of the next level, from prepare()
+    
+    def invalidate(self):
+        # Something else drew over the screen (e.g. the level intro)
+        self.full_redraw = True
+    
+    def prepare(self, grid):
+        # Put the background of a level that hasn't started yet together,
+        # as the camera will first see it. Runs on the LevelLoader's thread,
+        # so it only touches surfaces of its own; draw() switches to it once
+        # the game has the grid.
+        camera = Camera(*self.surface.get_size())
+        camera.follow(*PLAYER_START, grid)
+        background = Background(self.surface.get_size())
+        background.sync(grid, camera)
+        self.prepared = background
+    
+    def remember(self, state):
+        self.positions = {entity: (entity.x, entity.y) for entity in [state.player] + state.enemies}
+    
+    def position(self, entity, alpha):
+        x, y = entity.x, entity.y
+        old = self.positions.get(entity)
+        if old is None or abs(x - old[0]) + abs(y - old[1]) != 1:
+            return x, y  # Didn't step, or respawned
+        return old[0] + (x - old[0]) * alpha, old[1] + (y - old[1]) * alpha
+    
+    def draw(self, state, alpha=1.0):
+        surface = self.surface
+        background = self.background
+        camera = self.camera
+        player = state.player
+        profiler = self.profiler
+        if self.prepared is not None and self.prepared.grid is state.grid:
+            background = self.background = self.prepared
+            self.prepared = None
         
-        # Draw everything
-        screen.fill(BLACK)
-        draw_grid(grid)
+        player_x, player_y = self.position(player, alpha)
+        camera.follow(player_x, player_y, state.grid)
         
-        for bomb in bombs:
-            bomb.draw()
+        changed = background.sync(state.grid, camera)
+        full = self.full_redraw or changed is None
+        if full:
+            changed = []
+            surface.blit(background.surface, (0, 0))
+        else:
+            # Erase last frame's entities and HUD, and show the tiles that changed
+            for rect in self.previous + changed:
+                surface.blit(background.surface, rect, rect)
+        if profiler:
+            profiler.lap("grid", 1 if full else len(self.previous) + len(changed))
+        
+        dirty = []
+        calls = 0
+        for bomb in state.bombs:
+            if camera.sees(bomb.x, bomb.y):
+                x, y = camera.to_screen(bomb.x, bomb.y)
+                bomb.draw(x, y)
+                dirty.append(entity_rect(x, y))
+                calls += 1
         
-        for explosion in explosions:
-            explosion.draw()
+        for explosion in state.explosions:
+            calls += explosion.draw(state.effects, camera)
+            dirty.extend(entity_rect(*camera.to_screen(x, y)) for x, y in explosion.tiles if camera.sees(x, y))
         
-        for enemy in enemies:
-            enemy.draw()
+        for enemy in state.enemies:
+            x, y = self.position(enemy, alpha)
+            if camera.sees(x, y):
+                x, y = camera.to_screen(x, y)
+                enemy.draw(x, y)
+                dirty.append(entity_rect(x, y))
+                calls += 1
+        if profiler:
+            profiler.lap("entities", calls)
         
         # Draw UI (score and lives)
-        draw_ui(player)
+        ui = draw_ui(player)
+        dirty.extend(ui)
+        if profiler:
+            profiler.lap("ui", len(ui))
         
         if player.alive:
             # Don't draw player during respawn blink
-            if respawn_timer <= 0 or respawn_timer % 10 >= 5:
-                player.draw()
-            
-            # Display win message if all enemies are defeated
-            if win:
-                if not level_complete:
-                    level_complete = True
-                    level_complete_timer = 90  # 3 seconds at 30 FPS
-                
-                font = pygame.font.SysFont(None, 72)
-                text = font.render(f"Level {level} Complete!", True, GREEN)
-                screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 
-                                  SCREEN_HEIGHT // 2 - text.get_height() // 2))
-                
-                # Show next level message
-                next_font = pygame.font.SysFont(None, 36)
-                next_text = next_font.render(f"Next Level in {level_complete_timer//30 + 1}...", True, WHITE)
-                screen.blit(next_text, (SCREEN_WIDTH // 2 - next_text.get_width() // 2, 
-                                      SCREEN_HEIGHT // 2 + 50))
-                
-                # Play win sound once
-                if has_sound and not pygame.mixer.get_busy():
-                    sound_win.play()
-                    
-                # Countdown to next level
-                level_complete_timer -= 1
-                if level_complete_timer <= 0:
-                    # Save current score and lives
-                    score = player.score
-                    lives = player.lives
-                    level += 1
-                    running = False  # End current level loop
-        else:
-            font = pygame.font.SysFont(None, 72)
-            text = font.render("Game Over", True, RED)
-            screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 
-                              SCREEN_HEIGHT // 2 - text.get_height() // 2))
-            
-            # Display final score
-            score_font = pygame.font.SysFont(None, 48)
-            score_text = score_font.render(f"Final Score: {player.score}", True, WHITE)
-            screen.blit(score_text, (SCREEN_WIDTH // 2 - score_text.get_width() // 2, 
-                                    SCREEN_HEIGHT // 2 + 50))
+            if state.respawn_timer <= 0 or state.respawn_timer % 10 >= 5:
+                x, y = camera.to_screen(player_x, player_y)
+                player.draw(x, y)
+                dirty.append(entity_rect(x, y))
+                if profiler:
+                    profiler.lap("entities", 1)
         
-        pygame.display.flip()
-        clock.tick(30)  # 30 FPS
+        # The overlays cover most of the screen, so they force full redraws,
+        # this frame included: the game over screen waits for a key on it
+        overlay = state.win or not player.alive
+        if overlay:
+            draw_overlay(state)
+            full = True
+        if profiler:
+            if profiler.visible:
+                dirty.append(profiler.draw(surface))
+            profiler.lap("ui", int(overlay) + int(profiler.visible))
+        
+        if full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.previous + dirty + changed)
+        if profiler:
+            profiler.lap("flip", 1 if full else len(self.previous) + len(dirty) + len(changed))
+        self.previous = dirty
+        self.full_redraw = overlay
+
+# Player inputs understood by GameState.step()
+ACTION_UP = "up"
+ACTION_DOWN = "down"
+ACTION_LEFT = "left"
+ACTION_RIGHT = "right"
+ACTION_BOMB = "bomb"
+
+MOVE_ACTIONS = {
+    ACTION_UP: (0, -1),
+    ACTION_DOWN: (0, 1),
+    ACTION_LEFT: (-1, 0),
+    ACTION_RIGHT: (1, 0),
+}
+
+# Game rules (all timings are in ticks, 30 ticks = 1 second)
+PLAYER_START = (1, 1)
+START_LIVES = 3
+MOVE_COOLDOWN = 10
+RESPAWN_TICKS = 60
+LEVEL_COMPLETE_TICKS = 90
+MAX_ENEMIES = 10
+TICKS_PER_SECOND = 30
+RENDER_FPS = 120  # Frame rate cap of the window, 0 for none
+MAX_CATCH_UP_TICKS = 10  # Most ticks run in one frame to catch up after a stall
+LEVEL_INTRO_TIME = 2.0  # Seconds the level intro is shown for
+BOMB_FUSE = 90
+BOMB_RANGE = 2
+EXPLOSION_TICKS = 30
+ENEMY_MOVE_DELAY = 15
+ENEMY_SCORE = 100
+LIFE_BONUS = 200  # Per life left when a level is cleared
+
+def level_rng(seed, game, level):
+    # Logic stream for one level. It only depends on the game seed, how many
+    # games have been played with it and the level number, so a level can be
+    # generated again (or ahead of time) without replaying the ones before.
+    return random.Random(f"{seed}/{game}/{level}")
 
-def game_loop():
-    level = 1
-    score = 0
-    lives = 3
+def build_level(seed, game, level, width, height, monster_types, tick):
+    # The map and enemies of a level starting on `tick`, and its rng as the
+    # game goes on with it. It only depends on its arguments, so a level
+    # can be built ahead of time on another thread: the enemies get a clock
+    # of their own, swapped for the game's when the level starts.
+    rng = level_rng(seed, game, level)
+    grid, free = generate_level(width, height, rng)
+    enemies = spawn_enemies(grid, min(3 + level - 1, MAX_ENEMIES), Scheduler(tick), monster_types, rng, free)
+    return rng, grid, enemies
+
+class LevelLoader:
+    # Builds the next level on a worker thread while the level complete
+    # countdown runs, so starting it doesn't stall a frame (about 50 ms on a
+    # 256x256 map). `prepare` is also called with the new grid on the
+    # worker, to get what draws it ready too. GameState.start_level() asks
+    # for its level with take(), and builds it itself when this was
+    # building something else or failed.
+    def __init__(self, prepare=None):
+        self.prepare = prepare
+        self.args = None  # build_level() arguments of the level being built
+        self.thread = None
+        self.level = None
     
-    while True:
-        grid = create_grid()
-        player = Player(1, 1)
-        player.score = score  # Carry over score from previous level
-        player.lives = lives  # Carry over lives from previous level
-        enemies = spawn_enemies(grid, min(3 + level - 1, 10))  # More enemies each level, max 10
-        bombs = []
-        explosions = []
-        
-        running = True
-        respawn_timer = 0
-        win_bonus_added = False  # Flag to track if win bonus has been added
-        level_complete = False
-        level_complete_timer = 0
-        
-        # Movement control variables
-        move_cooldown = 0
-        key_pressed = False
-        
-        # Display level start message
-        screen.fill(BLACK)
-        font = pygame.font.SysFont(None, 72)
-        level_text = font.render(f"Level {level}", True, GREEN)
-        screen.blit(level_text, (SCREEN_WIDTH // 2 - level_text.get_width() // 2, 
-                              SCREEN_HEIGHT // 2 - level_text.get_height() // 2))
-        
-        # Display enemy count
-        enemy_font = pygame.font.SysFont(None, 36)
-        enemy_text = enemy_font.render(f"Enemies: {len(enemies)}", True, WHITE)
-        screen.blit(enemy_text, (SCREEN_WIDTH // 2 - enemy_text.get_width() // 2, 
-                               SCREEN_HEIGHT // 2 + 50))
-        
-        pygame.display.flip()
-        pygame.time.delay(2000)  # 2 second delay before level starts
-        
-        while running:
-            # Handle events
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE:
-                        player.place_bomb(bombs)
-                        if has_sound:
-                            sound_bomb.play()
-                    # Set key_pressed to True when arrow key is pressed
-                    elif event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT):
-                        key_pressed = True
-                elif event.type == pygame.KEYUP:
-                    # Reset key_pressed when arrow key is released
-                    if event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT):
-                        key_pressed = False
-                        move_cooldown = 0
-            
-            # Handle player movement if alive and not respawning
-            if player.alive and respawn_timer <= 0:
-                # Decrease move cooldown
-                if move_cooldown > 0:
-                    move_cooldown -= 1
-                
-                # Only move if cooldown is 0 and key is pressed
-                if move_cooldown == 0 and key_pressed:
-                    keys = pygame.key.get_pressed()
-                    moved = False
-                    
-                    if keys[pygame.K_UP]:
-                        player.move(0, -player.speed, grid)
-                        moved = True
-                    elif keys[pygame.K_DOWN]:
-                        player.move(0, player.speed, grid)
-                        moved = True
-                    elif keys[pygame.K_LEFT]:
-                        player.move(-player.speed, 0, grid)
-                        moved = True
-                    elif keys[pygame.K_RIGHT]:
-                        player.move(player.speed, 0, grid)
-                        moved = True
+    def start(self, args):
+        if args == self.args:
+            return
+        if self.thread:
+            self.thread.join()  # Only one level at a time
+        self.args = args
+        self.level = None
+        self.thread = threading.Thread(target=self.build, args=(args,), name="level", daemon=True)
+        self.thread.start()
+    
+    def build(self, args):
+        level = build_level(*args)
+        if self.prepare:
+            self.prepare(level[1])
+        self.level = level
+    
+    def take(self, args):
+        # The level built for `args`, waiting for the worker if it isn't
+        # done yet, or None
+        if self.thread is None or args != self.args:
+            return None
+        self.thread.join()
+        level = self.level
+        self.args = self.thread = self.level = None
+        return level
+
+class GameState:
+    # Pure game logic: no window, mixer or clock. step() advances the game by
+    # one tick and returns the events that happened, which the caller can
+    # turn into sounds or ignore.
+    #
+    # Timed things (fuses, explosions, enemy steps, respawning, the level
+    # complete countdown) are registered with the Scheduler instead of being
+    # counted down every tick, and each tick handles them in the same order
+    # as the old frame loop: respawn, player, bombs, explosions, enemies and
+    # finally the win check.
+    #
+    # All randomness comes from the game's own streams: rng drives the map,
+    # the enemies and everything else that changes the outcome, effects only
+    # drives cosmetics like explosion sparks. The same seed and the same
+    # actions always play out the same game, drawn or not.
+    def __init__(self, level=1, score=0, lives=START_LIVES, monster_types=MONSTER_TYPES, seed=None,
+                 width=GRID_WIDTH, height=GRID_HEIGHT):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.game = 0  # Games played with this seed, bumped on restart
+        self.effects = random.Random(f"{seed}/effects")
+        self.level = level
+        self.monster_types = monster_types
+        self.width = width  # Map size in tiles, the same for every level
+        self.height = height
+        self.scheduler = Scheduler()
+        self.flow = FlowField()
+        self.profiler = None  # Times the phases of step() when set
+        self.loader = None  # LevelLoader building the next level ahead of time, when set
+        self.start_level(score, lives)
+    
+    def start_level(self, score, lives):
+        self.scheduler.clear()
+        args = self.level_args(self.level, self.tick)
+        level = self.loader.take(args) if self.loader else None
+        self.rng, self.grid, self.enemies = level or build_level(*args)
+        self.player = Player(*PLAYER_START)
+        self.player.score = score  # Carry over score from previous level
+        self.player.lives = lives  # Carry over lives from previous level
+        for enemy in self.enemies:
+            enemy.clock = self.scheduler
+            self.scheduler.schedule(enemy.next_move_at, EVENT_ENEMY_MOVE, enemy)
+        self.enemy_at = SpatialIndex(self.width, self.height, self.enemies)  # Live enemies
+        self.bombs = []
+        self.bomb_at = {}  # (x, y) -> Bomb
+        self.explosions = []
+        self.fire = ExplosionMap(self.grid.width, self.grid.height)
+        self.danger = DangerMap(self.grid, self.scheduler, self.fire)
+        self.respawn_at = 0
+        self.dying = []  # Enemies killed this tick, scored on the next one
+        self.moved = []  # Enemies that stepped this tick, checked for fire on the next one
+        self.win = False
+        self.win_bonus_added = False
+        self.level_complete = False
+        self.next_level_at = 0
+    
+    def level_args(self, level, tick):
+        # build_level() arguments of `level` of this game, starting on `tick`
+        return (self.seed, self.game, level, self.width, self.height, self.monster_types, tick)
+    
+    def restart(self):
+        self.game += 1
+        self.level = 1
+        self.start_level(0, START_LIVES)
+    
+    @property
+    def tick(self):
+        return self.scheduler.tick
+    
+    @property
+    def game_over(self):
+        return not self.player.alive
+    
+    @property
+    def respawn_timer(self):
+        return max(0, self.respawn_at - self.tick)
+    
+    @property
+    def level_complete_timer(self):
+        return max(0, self.next_level_at - self.tick)
+    
+    @property
+    def player_vulnerable(self):
+        return self.player.alive and self.respawn_at <= self.tick
+    
+    def snapshot(self):
+        # Everything the game's future depends on, packed into flat arrays of
+        # ints, for bots that try moves out and go back. Treat it as opaque: it
+        # can be restored any number of times, into this state or another one.
+        # The cosmetic random stream is left out.
+        return (
+            self.seed, self.monster_types, self.game, self.level, self.tick,
+            self.respawn_at, self.next_level_at, self.win, self.win_bonus_added, self.level_complete,
+            self.rng.getstate(),
+            self.grid.width, self.grid.height, bytes(self.grid.cells),
+            array("q", self.player.pack()),
+            len(self.enemies), array("q", [f for enemy in self.enemies for f in enemy.pack()]),
+            len(self.bombs), array("q", [f for bomb in self.bombs for f in bomb.pack()]),
+            len(self.explosions), array("q", [f for explosion in self.explosions for f in explosion.pack()]),
+            array("q", [c for explosion in self.explosions for tile in explosion.tiles for c in tile]),
+            array("q", [self.enemies.index(enemy) for enemy in self.dying]),
+            array("q", [self.enemies.index(enemy) for enemy in self.moved]),
+            self.danger.pack(self.bombs),
+        )
+    
+    def restore(self, snapshot):
+        (self.seed, self.monster_types, self.game, self.level, tick,
+         self.respawn_at, self.next_level_at, win, win_bonus_added, level_complete,
+         rng_state,
+         width, height, cells,
+         player,
+         enemy_count, enemies,
+         bomb_count, bombs,
+         explosion_count, explosions,
+         tiles,
+         dying,
+         moved,
+         danger) = snapshot
+        self.win = bool(win)
+        self.win_bonus_added = bool(win_bonus_added)
+        self.level_complete = bool(level_complete)
+        self.rng.setstate(rng_state)
+        self.width, self.height = width, height
+        
+        # Overwrite the grid in place when it has the same size, so views of
+        # it (and the renderer's copy of the last frame) stay valid
+        if (width, height) == (self.grid.width, self.grid.height):
+            self.grid.cells[:] = cells
+        else:
+            self.grid = Grid.__new__(Grid)
+            self.grid.__setstate__((width, height, cells))
+        
+        scheduler = self.scheduler
+        scheduler.clear()
+        scheduler.tick = tick
+        self.player.unpack(player)
+        
+        # Rebuild the entities, then register them again in list order, which
+        # is the order their events were scheduled in
+        self.enemies = []
+        stride = len(enemies) // max(enemy_count, 1)
+        for i in range(enemy_count):
+            enemy = Enemy.__new__(Enemy)
+            enemy.unpack(enemies[i * stride:(i + 1) * stride], scheduler)
+            self.enemies.append(enemy)
+            if enemy.alive:
+                scheduler.schedule(enemy.next_move_at, EVENT_ENEMY_MOVE, enemy)
+        self.enemy_at = SpatialIndex(width, height, [enemy for enemy in self.enemies if enemy.alive])
+        self.dying = [self.enemies[i] for i in dying]
+        self.moved = [self.enemies[i] for i in moved]
+        
+        self.explosions = []
+        self.fire = ExplosionMap(width, height)
+        stride = len(explosions) // max(explosion_count, 1)
+        start = 0
+        for i in range(explosion_count):
+            fields = explosions[i * stride:(i + 1) * stride]
+            end = start + 2 * fields[-1]
+            explosion = Explosion.__new__(Explosion)
+            explosion.unpack(fields, scheduler, list(zip(tiles[start:end:2], tiles[start + 1:end:2])))
+            start = end
+            self.explosions.append(explosion)
+            self.fire.add(explosion)
+            scheduler.schedule(explosion.expire_at, EVENT_EXPIRE, explosion)
+        
+        self.bombs = []
+        self.bomb_at = {}
+        stride = len(bombs) // max(bomb_count, 1)
+        for i in range(bomb_count):
+            bomb = Bomb.__new__(Bomb)
+            bomb.unpack(bombs[i * stride:(i + 1) * stride], scheduler)
+            self.bombs.append(bomb)
+            self.bomb_at[(bomb.x, bomb.y)] = bomb
+            scheduler.schedule(bomb.detonate_at, EVENT_DETONATE, bomb)
+        self.danger = DangerMap(self.grid, scheduler, self.fire)
+        self.danger.unpack(danger, self.bombs)
+        
+        if self.respawn_at > tick:
+            scheduler.schedule(self.respawn_at, EVENT_RESPAWN)
+        if self.level_complete:
+            scheduler.schedule(self.next_level_at, EVENT_NEXT_LEVEL)
+    
+    def step(self, actions=()):
+        events = []
+        if self.game_over:
+            return events
+        
+        scheduler = self.scheduler
+        scheduler.tick += 1
+        tick = scheduler.tick
+        player = self.player
+        fire = self.fire
+        profiler = self.profiler
+        
+        move = None
+        detonations = deque()
+        for action in actions:
+            if action == ACTION_BOMB:
+                if player.bombs > 0 and (player.x, player.y) not in self.bomb_at:
+                    bomb = player.place_bomb(self.bombs, scheduler)
+                    self.add_bomb(bomb)
+                    events.append("bomb_placed")
                     
-                    # Set cooldown after movement
-                    if moved:
-                        move_cooldown = 10  # Adjust this value to control movement speed
-                
-                # Update player animation
-                player.update()
-            elif respawn_timer > 0:
-                respawn_timer -= 1
-                if respawn_timer <= 0:
-                    # Reset player position
-                    player.x = 1
-                    player.y = 1
+                    # Dropping a bomb into a blast sets it off right away
+                    if fire.is_burning(bomb.x, bomb.y):
+                        bomb.exploded = True
+                        detonations.append(bomb)
+            elif move is None and action in MOVE_ACTIONS:
+                move = MOVE_ACTIONS[action]
+        
+        # Player position changes are checked against enemies at the end
+        player_moved = False
+        if scheduler.pop_due(EVENT_RESPAWN):
+            # Reset player position, no moving on the tick of the respawn
+            player.x, player.y = PLAYER_START
+            player_moved = True
+        elif self.player_vulnerable:
+            # Handle player movement if alive and not respawning
+            if move is None:
+                # Releasing the keys lets the next press move immediately
+                player.next_move_at = 0
+            elif tick >= player.next_move_at:
+                old = (player.x, player.y)
+                player.move(move[0] * player.speed, move[1] * player.speed, self.grid, self.bomb_at)
+                player.next_move_at = tick + MOVE_COOLDOWN
+                player_moved = (player.x, player.y) != old
             
-            # Update bombs
-            for bomb in bombs[:]:
-                if bomb.update():
-                    bombs.remove(bomb)
-                    explosions.append(Explosion(bomb.x, bomb.y, bomb.explosion_range, grid))
-                    player.bombs += 1  # Return the bomb to the player
+            # Update player animation
+            player.update()
+        if profiler:
+            profiler.lap("player")
+        
+        # Set off the bombs whose fuse ran out
+        for bomb in scheduler.pop_due(EVENT_DETONATE):
+            if not bomb.exploded:
+                bomb.exploded = True
+                detonations.append(bomb)
+        new_fire = bool(detonations)
+        if new_fire:
+            self.detonate(detonations, events)
+        
+        # Check if player is hit by explosion (expiring ones still burn this tick)
+        expired = scheduler.pop_due(EVENT_EXPIRE)
+        if self.player_vulnerable and fire.is_burning(player.x, player.y):
+            self.hit_player(events)
+        
+        if expired:
+            for explosion in expired:
+                fire.remove(explosion)
+            gone = set(map(id, expired))
+            self.explosions = [e for e in self.explosions if id(e) not in gone]
+        if profiler:
+            profiler.lap("bombs")
+        
+        # Enemies killed on the last tick are scored now
+        for enemy in self.dying:
+            player.score += ENEMY_SCORE
+            self.enemies.remove(enemy)
+            events.append("enemy_died")
+        self.dying = []
+        
+        # Check if enemies are hit by explosion: only new explosions or an
+        # enemy stepping into a blast can put one on a burning tile
+        suspects = self.enemies if new_fire else self.moved
+        for enemy in suspects:
+            if enemy.alive and fire.is_burning(enemy.x, enemy.y):
+                enemy.alive = False
+                self.enemy_at.remove(enemy)
+                self.dying.append(enemy)
+        
+        # Move the enemies whose turn it is. Hunters share one flow field,
+        # refreshed the first time one of them needs it this tick.
+        self.moved = []
+        flow = None
+        for enemy in scheduler.pop_due(EVENT_ENEMY_MOVE):
+            if enemy.alive:
+                if enemy.behavior == "hunt" and flow is None:
+                    flow = self.flow
+                    flow.update(self.grid, player.x, player.y)
+                x, y = enemy.x, enemy.y
+                if enemy.update(self.grid, flow, self.danger, self.rng, self.bomb_at):
+                    self.enemy_at.move(enemy, x, y)
+                    self.moved.append(enemy)
+                scheduler.schedule(enemy.next_move_at, EVENT_ENEMY_MOVE, enemy)
+        
+        # Check if player collides with enemy
+        if (player_moved or self.moved) and self.player_vulnerable and self.enemy_at.is_occupied(player.x, player.y):
+            self.hit_player(events)
+        
+        # Check win condition
+        self.win = not self.enemies and player.alive
+        if self.win:
+            if not self.win_bonus_added:
+                # Add bonus for completing the level (only once)
+                player.score += player.lives * LIFE_BONUS
+                self.win_bonus_added = True
             
-            # Update explosions
-            for explosion in explosions[:]:
-                if explosion.update():
-                    explosions.remove(explosion)
-                
-                # Check if player is hit by explosion
-                if player.alive and respawn_timer <= 0:
-                    for x, y in explosion.tiles:
-                        if player.x == x and player.y == y:
-                            if has_sound:
-                                sound_player_die.play()
-                            if not player.lose_life():
-                                # Game over
-                                if has_sound:
-                                    sound_game_over.play()
-                            else:
-                                # Start respawn timer
-                                respawn_timer = 60  # 2 seconds at 30 FPS
+            if not self.level_complete:
+                self.level_complete = True
+                self.next_level_at = tick + LEVEL_COMPLETE_TICKS - 1
+                scheduler.schedule(self.next_level_at, EVENT_NEXT_LEVEL)
+                if self.loader:
+                    self.loader.start(self.level_args(self.level + 1, self.next_level_at))
+                events.append("level_complete")
             
-            # Update enemies
-            for enemy in enemies[:]:
-                if enemy.alive:
-                    enemy.update(grid, explosions)
-                    
-                    # Check if player collides with enemy
-                    if player.alive and respawn_timer <= 0 and player.x == enemy.x and player.y == enemy.y:
-                        if has_sound:
-                            sound_player_die.play()
-                        if not player.lose_life():
-                            # Game over
-                            if has_sound:
-                                sound_game_over.play()
-                        else:
-                            # Start respawn timer
-                            respawn_timer = 60  # 2 seconds at 30 FPS
-                else:
-                    # Enemy killed, add score
-                    player.score += 100
-                    if has_sound:
-                        sound_enemy_die.play()
-                    enemies.remove(enemy)
+            # Countdown to next level
+            if scheduler.pop_due(EVENT_NEXT_LEVEL):
+                self.level += 1
+                self.start_level(player.score, player.lives)
+                events.append("level_started")
+        
+        if profiler:
+            profiler.lap("enemies")
+        return events
+    
+    def occupants(self, x, y):
+        # Everything on a tile: the player, a bomb and any live enemies, in
+        # that order. The enemies are only looked for when the index says
+        # there are some.
+        found = []
+        if (self.player.x, self.player.y) == (x, y):
+            found.append(self.player)
+        bomb = self.bomb_at.get((x, y))
+        if bomb is not None:
+            found.append(bomb)
+        if self.enemy_at.is_occupied(x, y):
+            found.extend(enemy for enemy in self.enemies if enemy.alive and enemy.x == x and enemy.y == y)
+        return found
+    
+    def is_open(self, x, y):
+        # Whether the player or an enemy could step onto a tile
+        return self.grid.is_walkable(x, y) and (x, y) not in self.bomb_at
+    
+    def add_bomb(self, bomb):
+        # Register a bomb that is already in self.bombs
+        self.bomb_at[(bomb.x, bomb.y)] = bomb
+        self.scheduler.schedule(bomb.detonate_at, EVENT_DETONATE, bomb)
+        self.danger.add_bomb(bomb)
+    
+    def detonate(self, queue, events):
+        # Resolve a whole chain reaction in one pass: every explosion sets off
+        # the bombs lying in its path, which are queued and detonated in turn.
+        # Queued bombs are marked exploded so they are only queued once.
+        bomb_at = self.bomb_at
+        while queue:
+            bomb = queue.popleft()
+            del bomb_at[(bomb.x, bomb.y)]
+            self.danger.remove_bomb(bomb)
+            explosion = Explosion(bomb.x, bomb.y, bomb.explosion_range, self.grid, self.scheduler)
+            if explosion.destroyed:
+                self.danger.blocks_destroyed(explosion.destroyed)
+            self.explosions.append(explosion)
+            self.fire.add(explosion)
+            self.scheduler.schedule(explosion.expire_at, EVENT_EXPIRE, explosion)
+            self.player.bombs += 1  # Return the bomb to the player
+            events.append("explosion")
             
-            # Check win condition
-            if not enemies and player.alive:
-                if not win_bonus_added:
-                    # Add bonus for completing the level (only once)
-                    if player.lives > 0:
-                        player.score += player.lives * 200
-                    win_bonus_added = True
-                win = True
-            else:
-                win = False
+            for tile in explosion.tiles:
+                other = bomb_at.get(tile)
+                if other is not None and not other.exploded:
+                    other.exploded = True
+                    queue.append(other)
+        
+        self.bombs = [bomb for bomb in self.bombs if not bomb.exploded]
+    
+    def hit_player(self, events):
+        events.append("player_died")
+        if not self.player.lose_life():
+            events.append("game_over")
+        else:
+            # Start respawn timer
+            self.respawn_at = self.tick + RESPAWN_TICKS
+            self.scheduler.schedule(self.respawn_at, EVENT_RESPAWN)
+
+def random_policy(state, rng):
+    # Baseline bot used by the headless mode: wanders and drops the odd bomb
+    actions = []
+    if rng.random() < 0.3:
+        actions.append(rng.choice(list(MOVE_ACTIONS)))
+    if rng.random() < 0.02:
+        actions.append(ACTION_BOMB)
+    return actions
+
+def play_sounds(events):
+    if not events or not init_sound():
+        return
+    for event in events:
+        sound = sounds.get(event)
+        if sound:
+            sound.play()
+
+def draw_level_intro(state):
+    # Display level start message
+    screen.fill(BLACK)
+    level_text = render_text(72, f"Level {state.level}", GREEN)
+    screen.blit(level_text, (SCREEN_WIDTH // 2 - level_text.get_width() // 2, 
+                          SCREEN_HEIGHT // 2 - level_text.get_height() // 2))
+    
+    # Display enemy count
+    enemy_text = render_text(36, f"Enemies: {len(state.enemies)}", WHITE)
+    screen.blit(enemy_text, (SCREEN_WIDTH // 2 - enemy_text.get_width() // 2, 
+                           SCREEN_HEIGHT // 2 + 50))
+    pygame.display.flip()
+
+def draw_overlay(state):
+    player = state.player
+    if player.alive:
+        # Display win message if all enemies are defeated
+        text = render_text(72, f"Level {state.level} Complete!", GREEN)
+        screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 
+                          SCREEN_HEIGHT // 2 - text.get_height() // 2))
+        
+        # Show next level message
+        next_text = render_text(36, f"Next Level in {state.level_complete_timer//30 + 1}...", WHITE)
+        screen.blit(next_text, (SCREEN_WIDTH // 2 - next_text.get_width() // 2, 
+                              SCREEN_HEIGHT // 2 + 50))
+    else:
+        text = render_text(72, "Game Over", RED)
+        screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 
+                          SCREEN_HEIGHT // 2 - text.get_height() // 2))
+        
+        # Display final score
+        score_text = render_text(48, f"Final Score: {player.score}", WHITE)
+        screen.blit(score_text, (SCREEN_WIDTH // 2 - score_text.get_width() // 2, 
+                                SCREEN_HEIGHT // 2 + 50))
+        
+        # Display restart message
+        restart_text = render_text(36, "Press any key to restart", WHITE)
+        screen.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, 
+                                 SCREEN_HEIGHT // 2 + 100))
+
+def wait_for_key():
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                return
+        pygame.time.wait(10)
+
+# pygame key -> action, filled in on first use so that importing this
+# module doesn't load pygame
+ARROW_KEYS = {}
+
+def read_actions(key_pressed, commands=None):
+    # Translate pygame events into GameState actions. `commands` maps keys
+    # that don't play the game (like the profiler toggle) to what they do.
+    if not ARROW_KEYS:
+        ARROW_KEYS.update({
+            pygame.K_UP: ACTION_UP,
+            pygame.K_DOWN: ACTION_DOWN,
+            pygame.K_LEFT: ACTION_LEFT,
+            pygame.K_RIGHT: ACTION_RIGHT,
+        })
+    actions = []
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE:
+                actions.append(ACTION_BOMB)
+            elif commands and event.key in commands:
+                commands[event.key]()
+            # Set key_pressed to True when arrow key is pressed
+            elif event.key in ARROW_KEYS:
+                key_pressed = True
+        elif event.type == pygame.KEYUP:
+            # Reset key_pressed when arrow key is released
+            if event.key in ARROW_KEYS:
+                key_pressed = False
+    
+    # Holding an arrow key repeats the move (GameState applies the cooldown)
+    if key_pressed:
+        keys = pygame.key.get_pressed()
+        for key, action in ARROW_KEYS.items():
+            if keys[key]:
+                actions.append(action)
+                break
+    return actions, key_pressed
+
+# Replay files: a header with the game seed and monster types, then the
+# inputs as (ticks since the last change, new input) records. Every input a
+# tick can have fits in one byte, since only the first move counts and extra
+# bombs on the same tick are no-ops, and nothing is written while the input
+# stays the same, so idle stretches and held keys cost nothing. Records are
+# written and read as the game goes, so long sessions never sit in memory.
+REPLAY_MAGIC = b"BMBR"
+REPLAY_VERSION = 2  # Version 1 had no map size, it was always the standard one
+REPLAY_MOVES = [None, ACTION_UP, ACTION_DOWN, ACTION_LEFT, ACTION_RIGHT]
+REPLAY_BOMB = 8
+REPLAY_END = 0xFF
+
+def encode_actions(actions):
+    code = 0
+    for action in actions:
+        if action == ACTION_BOMB:
+            code |= REPLAY_BOMB
+        elif code & 7 == 0 and action in MOVE_ACTIONS:
+            code |= REPLAY_MOVES.index(action)
+    return code
+
+def decode_actions(code):
+    actions = []
+    if code & REPLAY_BOMB:
+        actions.append(ACTION_BOMB)
+    if code & 7:
+        actions.append(REPLAY_MOVES[code & 7])
+    return actions
+
+def write_varint(stream, value):
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+    stream.write(data)
+
+def read_varint(stream):
+    # None at the end of the stream
+    value = shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            return None
+        value |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+def write_text(stream, text):
+    data = text.encode("utf-8")
+    write_varint(stream, len(data))
+    stream.write(data)
+
+def read_text(stream):
+    return stream.read(read_varint(stream)).decode("utf-8")
+
+class ReplayWriter:
+    def __init__(self, path, seed, monster_types=MONSTER_TYPES, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.file = open(path, "wb")
+        self.file.write(REPLAY_MAGIC + bytes([REPLAY_VERSION]))
+        # The seed is kept as text, which seeds the game's streams exactly
+        # like the original value
+        write_text(self.file, str(seed))
+        write_text(self.file, ",".join(monster_types))
+        write_varint(self.file, width)
+        write_varint(self.file, height)
+        self.code = 0
+        self.run = 0  # Ticks since the input last changed
+    
+    def record(self, actions):
+        # Called once per tick with the actions passed to GameState.step
+        code = encode_actions(actions)
+        if code != self.code:
+            write_varint(self.file, self.run)
+            self.file.write(bytes([code]))
+            self.code = code
+            self.run = 0
+        self.run += 1
+    
+    def close(self):
+        write_varint(self.file, self.run)
+        self.file.write(bytes([REPLAY_END]))
+        self.file.close()
+
+class ReplayReader:
+    # Iterating yields the actions of each recorded tick in order. A replay
+    # cut short (say the game crashed) plays up to its last input change.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        header = self.file.read(len(REPLAY_MAGIC) + 1)
+        if header[:-1] != REPLAY_MAGIC or not 1 <= header[-1] <= REPLAY_VERSION:
+            self.file.close()
+            raise ValueError(f"{path} is not a replay of version {REPLAY_VERSION} or older")
+        self.seed = read_text(self.file)
+        self.monster_types = read_text(self.file).split(",")
+        self.width, self.height = GRID_WIDTH, GRID_HEIGHT
+        if header[-1] >= 2:
+            self.width = read_varint(self.file)
+            self.height = read_varint(self.file)
+    
+    def __iter__(self):
+        actions = []
+        while True:
+            run = read_varint(self.file)
+            code = self.file.read(1)
+            if run is None or not code:
+                return
+            for _ in range(run):
+                yield actions
+            if code[0] == REPLAY_END:
+                return
+            actions = decode_actions(code[0])
+    
+    def close(self):
+        self.file.close()
+
+class FixedTimestep:
+    # Turns real time into whole game ticks. Every frame adds the time that
+    # went by to an accumulator and advance() says how many ticks are due,
+    # so the game runs at TICKS_PER_SECOND however fast or slow frames are.
+    # After a long stall only MAX_CATCH_UP_TICKS are run and the rest of the
+    # backlog is dropped, rather than freezing the game while it catches up.
+    def __init__(self, rate=TICKS_PER_SECOND, max_catch_up=MAX_CATCH_UP_TICKS):
+        self.step = 1 / rate
+        self.max_catch_up = max_catch_up
+        self.dropped = 0
+        self.reset()
+    
+    def reset(self):
+        # Start counting from now, e.g. after a screen that blocked
+        self.last = time.perf_counter()
+        self.lag = 0.0
+    
+    def advance(self):
+        now = time.perf_counter()
+        self.lag += now - self.last
+        self.last = now
+        ticks = int(self.lag / self.step)
+        if ticks > self.max_catch_up:
+            self.dropped += ticks - self.max_catch_up
+            self.lag -= (ticks - self.max_catch_up) * self.step
+            ticks = self.max_catch_up
+        self.lag -= ticks * self.step
+        return ticks
+    
+    @property
+    def alpha(self):
+        # How far into the next tick we are, for interpolation
+        return min(self.lag / self.step, 1.0)
+
+class FrameStats:
+    # Frame and tick timings, printed every few seconds so it's easy to
+    # check that the game keeps its speed whatever the frame rate does
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.reset()
+    
+    def reset(self):
+        self.started = time.perf_counter()
+        self.frame_times = []
+        self.tick_times = []
+        self.dropped = 0
+    
+    def report(self, timer):
+        elapsed = time.perf_counter() - self.started
+        if elapsed < self.interval or not self.frame_times:
+            return
+        frames, ticks = self.frame_times, self.tick_times or [0.0]
+        print(f"{len(frames) / elapsed:.1f} fps (frame avg {sum(frames) / len(frames) * 1000:.1f} ms, "
+              f"max {max(frames) * 1000:.1f} ms), {len(self.tick_times) / elapsed:.1f} ticks/sec "
+              f"(tick avg {sum(ticks) / len(ticks) * 1000:.2f} ms, max {max(ticks) * 1000:.2f} ms), "
+              f"{timer.dropped - self.dropped} ticks dropped")
+        self.reset()
+        self.dropped = timer.dropped
+
+# Frame phases in the order they happen, the game's own in GameState.step()
+PROFILE_PHASES = ["events", "player", "bombs", "enemies", "grid", "entities", "ui", "flip", "wait"]
+PROFILE_WINDOW = 300  # Frames the percentiles are taken over
+PROFILE_REFRESH = 15  # Frames between overlay updates, so it stays readable
+PROFILE_LOG_INTERVAL = 5.0  # Seconds between reports with --profile
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class Profiler:
+    # Splits every frame into phases and keeps the timings and draw calls of
+    # the last PROFILE_WINDOW frames. lap(phase) charges the time since the
+    # previous lap to `phase`, so timing a section costs a single
+    # perf_counter() call, and the ticks run in one frame add up. Frames are
+    # closed with end_frame(); headless, every tick is a frame.
+    def __init__(self, window=PROFILE_WINDOW):
+        self.times = {phase: deque(maxlen=window) for phase in PROFILE_PHASES}
+        self.calls = {phase: deque(maxlen=window) for phase in PROFILE_PHASES}
+        self.frame_times = deque(maxlen=window)
+        self.frame_time = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.frame_calls = dict.fromkeys(PROFILE_PHASES, 0)
+        self.frames = 0
+        self.visible = False
+        self.overlay = None
+        self.frame_start = self.last = time.perf_counter()
+    
+    def toggle(self):
+        self.visible = not self.visible
+    
+    def lap(self, phase, calls=0):
+        now = time.perf_counter()
+        self.frame_time[phase] += now - self.last
+        self.frame_calls[phase] += calls
+        self.last = now
+    
+    def skip(self):
+        # Leave out the time since the last lap, e.g. a screen that blocked
+        self.frame_start = self.last = time.perf_counter()
+    
+    def end_frame(self):
+        for phase in PROFILE_PHASES:
+            self.times[phase].append(self.frame_time[phase])
+            self.calls[phase].append(self.frame_calls[phase])
+            self.frame_time[phase] = 0.0
+            self.frame_calls[phase] = 0
+        self.frame_times.append(self.last - self.frame_start)
+        self.frame_start = self.last
+        self.frames += 1
+    
+    def report(self):
+        # p50/p95/p99 of each phase in ms and its average draw calls per
+        # frame, leaving out the phases that never ran
+        lines = [f"{'phase':<9}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}{'calls':>7}"]
+        rows = [(phase, self.times[phase], self.calls[phase]) for phase in PROFILE_PHASES]
+        rows.append(("frame", self.frame_times, None))
+        for phase, times, calls in rows:
+            if not times or not any(times):
+                continue
+            ordered = sorted(times)
+            line = f"{phase:<9}" + "".join(f"{percentile(ordered, q) * 1000:8.3f}" for q in (0.5, 0.95, 0.99))
+            if calls and any(calls):
+                line += f"{sum(calls) / len(calls):7.1f}"
+            lines.append(line)
+        return lines
+    
+    def draw(self, surface):
+        # The report in the top left corner, returns the rect it covers
+        if self.overlay is None or self.frames % PROFILE_REFRESH == 0:
+            font = get_font(20)
+            lines = [font.render(line, True, WHITE) for line in self.report()]
+            height = font.get_linesize()
+            self.overlay = pygame.Surface((max(line.get_width() for line in lines) + 10, height * len(lines) + 10))
+            self.overlay.set_alpha(200)
+            for i, line in enumerate(lines):
+                self.overlay.blit(line, (5, 5 + i * height))
+        return surface.blit(self.overlay, (10, 50))
+
+class InputBuffer:
+    # Frames are read more often than ticks run, so inputs are collected
+    # until the next tick takes them: a bomb press waits for it, and a held
+    # arrow key keeps moving through the ticks of a catch-up frame
+    def __init__(self, commands=None):
+        self.commands = commands
+        self.reset()
+    
+    def reset(self):
+        self.key_pressed = False
+        self.held = None
+        self.move = None
+        self.bomb = False
+    
+    def poll(self):
+        actions, self.key_pressed = read_actions(self.key_pressed, self.commands)
+        moves = [action for action in actions if action != ACTION_BOMB]
+        self.held = moves[0] if moves else None
+        self.move = self.held or self.move
+        self.bomb = self.bomb or ACTION_BOMB in actions
+    
+    def take(self):
+        actions = []
+        if self.bomb:
+            actions.append(ACTION_BOMB)
+        if self.move:
+            actions.append(self.move)
+        self.bomb = False
+        self.move = self.held
+        return actions
+
+def game_loop(monster_types=MONSTER_TYPES, seed=None, record=None, fps=RENDER_FPS, show_stats=False,
+              frame_delay=0, profile=False, map_size=(GRID_WIDTH, GRID_HEIGHT)):
+    # Logic runs at a fixed TICKS_PER_SECOND while frames are drawn as fast
+    # as `fps` allows, interpolating between ticks. frame_delay (ms) slows
+    # every frame down, to check how the game holds up on a slow machine.
+    # Frames are always profiled: F3 shows the overlay, and with `profile`
+    # the report is printed every PROFILE_LOG_INTERVAL seconds.
+    state = GameState(monster_types=monster_types, seed=seed, width=map_size[0], height=map_size[1])
+    profiler = Profiler()
+    state.profiler = profiler
+    renderer = Renderer(screen, profiler)
+    state.loader = LevelLoader(renderer.prepare)
+    recorder = ReplayWriter(record, state.seed, monster_types, state.width, state.height) if record else None
+    inputs = InputBuffer({pygame.K_F3: profiler.toggle})
+    timer = FixedTimestep()
+    stats = FrameStats() if show_stats else None
+    
+    def intro():
+        # Show the level intro, returns when it ends
+        draw_level_intro(state)
+        return time.perf_counter() + LEVEL_INTRO_TIME
+    
+    def resume():
+        # Screens that stopped the game don't count towards the ticks or the stats
+        renderer.invalidate()
+        inputs.reset()
+        timer.reset()
+        profiler.skip()
+        if stats:
+            stats.reset()
+            stats.dropped = timer.dropped
+    
+    intro_until = intro()
+    frame_start = logged_at = time.perf_counter()
+    try:
+        while True:
+            inputs.poll()
+            if intro_until:
+                # The game waits for the intro to end, but events are still
+                # handled so the window stays responsive (and can be closed)
+                if time.perf_counter() < intro_until:
+                    pygame.time.wait(10)
+                    continue
+                intro_until = None
+                resume()
+                continue
+            profiler.lap("events")
+            level_started = False
+            for _ in range(timer.advance()):
+                actions = inputs.take()
+                if recorder:
+                    recorder.record(actions)
+                renderer.remember(state)
+                tick_start = time.perf_counter()
+                profiler.lap("events")
+                events = state.step(actions)
+                if stats:
+                    stats.tick_times.append(time.perf_counter() - tick_start)
+                play_sounds(events)
+                profiler.lap("events")
+                
+                level_started = "level_started" in events
+                if level_started or state.game_over:
+                    break
             
-            # Draw everything
-            screen.fill(BLACK)
-            draw_grid(grid)
+            if level_started:
+                intro_until = intro()
+                continue
             
-            for bomb in bombs:
-                bomb.draw()
+            renderer.draw(state, timer.alpha)
             
-            for explosion in explosions:
-                explosion.draw()
+            # Play win sound while the level complete countdown runs
+            if state.win and init_sound() and not pygame.mixer.get_busy():
+                play_sounds(["win"])
             
-            for enemy in enemies:
-                enemy.draw()
+            if state.game_over:
+                # Wait for key press to restart
+                wait_for_key()
+                state.restart()
+                intro_until = intro()
+                continue
             
-            # Draw UI (score and lives)
-            draw_ui(player)
+            if frame_delay:
+                pygame.time.delay(frame_delay)
+            clock.tick(fps)
+            profiler.lap("wait")
+            profiler.end_frame()
+            if profile and profiler.last - logged_at >= PROFILE_LOG_INTERVAL:
+                print("\n".join(profiler.report()))
+                logged_at = profiler.last
+            if stats:
+                now = time.perf_counter()
+                stats.frame_times.append(now - frame_start)
+                frame_start = now
+                stats.report(timer)
+    finally:
+        # Quitting exits from inside the loop, the replay still gets its end
+        if recorder:
+            recorder.close()
+
+def run_headless(ticks, seed=None, monster_types=MONSTER_TYPES, profile=False, map_size=(GRID_WIDTH, GRID_HEIGHT)):
+    # Simulate with a random bot and no rendering at all. With `profile`
+    # every tick is timed phase by phase, and the report printed at the end.
+    state = GameState(monster_types=monster_types, seed=seed, width=map_size[0], height=map_size[1])
+    rng = random.Random(f"{state.seed}/bot")
+    profiler = state.profiler = Profiler(window=None) if profile else None
+    levels = games = 0
+    
+    start = time.perf_counter()
+    for _ in range(ticks):
+        actions = random_policy(state, rng)
+        if profiler:
+            profiler.lap("events")
+        events = state.step(actions)
+        if profiler:
+            profiler.end_frame()
+        if "level_started" in events:
+            levels += 1
+        if state.game_over:
+            games += 1
+            state.restart()
+    elapsed = time.perf_counter() - start
+    
+    print(f"Simulated {ticks} ticks in {elapsed:.3f}s "
+          f"({ticks / elapsed:,.0f} ticks/sec, {levels} levels cleared, {games} games over, "
+          f"seed {state.seed})")
+    if profiler:
+        print("\n".join(profiler.report()))
+
+def play_replay(path, headless=False, speed=1.0):
+    # Re-simulate a recorded game, without drawing when headless (as fast
+    # as possible) or drawn at `speed` times the normal tick rate
+    replay = ReplayReader(path)
+    state = GameState(monster_types=replay.monster_types, seed=replay.seed, width=replay.width, height=replay.height)
+    renderer = None if headless else Renderer(screen)
+    if renderer:
+        state.loader = LevelLoader(renderer.prepare)
+    ticks = levels = games = score = 0
+    
+    start = time.perf_counter()
+    try:
+        for actions in replay:
+            events = state.step(actions)
+            ticks += 1
+            score = state.player.score
+            if "level_started" in events:
+                levels += 1
             
-            if player.alive:
-                # Don't draw player during respawn blink
-                if respawn_timer <= 0 or respawn_timer % 10 >= 5:
-                    player.draw()
-                
-                # Display win message if all enemies are defeated
-                if win:
-                    if not level_complete:
-                        level_complete = True
-                        level_complete_timer = 90  # 3 seconds at 30 FPS
-                    
-                    font = pygame.font.SysFont(None, 72)
-                    text = font.render(f"Level {level} Complete!", True, GREEN)
-                    screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 
-                                      SCREEN_HEIGHT // 2 - text.get_height() // 2))
-                    
-                    # Show next level message
-                    next_font = pygame.font.SysFont(None, 36)
-                    next_text = next_font.render(f"Next Level in {level_complete_timer//30 + 1}...", True, WHITE)
-                    screen.blit(next_text, (SCREEN_WIDTH // 2 - next_text.get_width() // 2, 
-                                          SCREEN_HEIGHT // 2 + 50))
-                    
-                    # Play win sound once
-                    if has_sound and not pygame.mixer.get_busy():
-                        sound_win.play()
-                        
-                    # Countdown to next level
-                    level_complete_timer -= 1
-                    if level_complete_timer <= 0:
-                        # Save current score and lives
-                        score = player.score
-                        lives = player.lives
-                        level += 1
-                        running = False  # End current level loop
-            else:
-                font = pygame.font.SysFont(None, 72)
-                text = font.render("Game Over", True, RED)
-                screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 
-                                  SCREEN_HEIGHT // 2 - text.get_height() // 2))
-                
-                # Display final score
-                score_font = pygame.font.SysFont(None, 48)
-                score_text = score_font.render(f"Final Score: {player.score}", True, WHITE)
-                screen.blit(score_text, (SCREEN_WIDTH // 2 - score_text.get_width() // 2, 
-                                        SCREEN_HEIGHT // 2 + 50))
-                
-                # Display restart message
-                restart_font = pygame.font.SysFont(None, 36)
-                restart_text = restart_font.render("Press any key to restart", True, WHITE)
-                screen.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, 
-                                         SCREEN_HEIGHT // 2 + 100))
-                
-                pygame.display.flip()
-                
-                # Wait for key press to restart
-                waiting_for_key = True
-                while waiting_for_key:
-                    for event in pygame.event.get():
-                        if event.type == pygame.QUIT:
-                            pygame.quit()
-                            sys.exit()
-                        elif event.type == pygame.KEYDOWN:
-                            waiting_for_key = False
-                            level = 1
-                            score = 0
-                            lives = 3
-                            running = False
+            if renderer:
+                if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                    break
+                play_sounds(events)
+                if "level_started" in events:
+                    renderer.invalidate()
+                renderer.draw(state)
+                if speed > 0:
+                    clock.tick(TICKS_PER_SECOND * speed)
             
-            pygame.display.flip()
-            clock.tick(30)  # 30 FPS
+            # The player pressed a key to restart, which is not a tick
+            if state.game_over:
+                games += 1
+                state.restart()
+                if renderer:
+                    renderer.invalidate()
+    finally:
+        replay.close()
+    elapsed = time.perf_counter() - start
+    
+    print(f"Replayed {ticks} ticks in {elapsed:.3f}s "
+          f"({ticks / max(elapsed, 1e-9):,.0f} ticks/sec, {levels} levels cleared, {games} games over, "
+          f"final score {score})")
+
+MIN_MAP_SIZE = 7
+
+def map_size(text):
+    # "WIDTHxHEIGHT" in tiles, for --map
+    try:
+        width, height = (int(n) for n in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, like 64x48, not {text!r}")
+    if min(width, height) < MIN_MAP_SIZE:
+        raise argparse.ArgumentTypeError(f"maps are at least {MIN_MAP_SIZE}x{MIN_MAP_SIZE} tiles")
+    return width, height
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bomberman")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the simulation without a window and report ticks/sec")
+    parser.add_argument("--ticks", type=int, default=10000,
+                        help="number of ticks to simulate in headless mode")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the game (and the headless bot), random if not given")
+    parser.add_argument("--hunters", action="store_true",
+                        help="also spawn hunters that chase the player")
+    parser.add_argument("--map", type=map_size, default=(GRID_WIDTH, GRID_HEIGHT), metavar="WxH",
+                        help=f"map size in tiles (default: {GRID_WIDTH}x{GRID_HEIGHT}, one screen); bigger maps "
+                             "scroll with the player")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record a replay of the game to PATH")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="play back a recorded replay (at full speed with --headless)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument("--fps", type=int, default=RENDER_FPS,
+                        help=f"frame rate cap, 0 for none (the game itself always runs at {TICKS_PER_SECOND} ticks/sec)")
+    parser.add_argument("--stats", action="store_true",
+                        help="print frame and tick timings every few seconds")
+    parser.add_argument("--frame-delay", type=int, default=0, metavar="MS",
+                        help="slow every frame down by MS milliseconds, to try the game on a slow machine")
+    parser.add_argument("--profile", action="store_true",
+                        help="print p50/p95/p99 timings and draw calls of every frame phase (every few "
+                             "seconds, or at the end with --headless); F3 shows them in the game")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    game_loop()
-    pygame.quit()
-    sys.exit()
\ No newline at end of file
+    args = parse_args()
+    monster_types = HUNTER_TYPES if args.hunters else MONSTER_TYPES
+    if args.replay:
+        if not args.headless:
+            init_display()
+        play_replay(args.replay, args.headless, args.speed)
+    elif args.headless:
+        run_headless(args.ticks, args.seed, monster_types, args.profile, args.map)
+    else:
+        init_display()
+        game_loop(monster_types, args.seed, args.record, args.fps, args.stats, args.frame_delay, args.profile,
+                  args.map)
+    if screen is not None:
+        pygame.quit()  # Headless runs never loaded it
\ No newline at end of file
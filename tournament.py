@@ -0,0 +1,203 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import importlib
+from multiprocessing import Pool
+
+from bomberman import (ACTION_BOMB, BLOCK, BOMB_FUSE, HUNTER_TYPES, MONSTER_TYPES, MOVE_ACTIONS, GameState,
+                       random_policy)
+
+def idle_policy(state, rng):
+    # Stands still: the baseline every bot should beat
+    return []
+
+def cautious_policy(state, rng):
+    # Wanders like the random bot, but never steps into a blast or next to
+    # an enemy, runs from bombs about to go off and enemies close by, and
+    # only bombs blocks it stands next to
+    player, grid, danger = state.player, state.grid, state.danger
+    x, y = player.x, player.y
+    near = {(enemy.x + dx, enemy.y + dy) for enemy in state.enemies if enemy.alive
+            for dx, dy in [(0, 0)] + list(MOVE_ACTIONS.values())}
+    moves = [action for action, (dx, dy) in MOVE_ACTIONS.items()
+             if state.is_open(x + dx, y + dy) and danger.is_safe(x + dx, y + dy) and (x + dx, y + dy) not in near]
+    if not danger.is_safe(x, y, BOMB_FUSE // 2) or (x, y) in near:
+        return [rng.choice(moves)] if moves else []
+    
+    actions = []
+    if moves and rng.random() < 0.3:
+        actions.append(rng.choice(moves))
+    if not state.bombs and rng.random() < 0.1 and any(
+            grid.get(x + dx, y + dy) == BLOCK for dx, dy in MOVE_ACTIONS.values()):
+        actions.append(ACTION_BOMB)
+    return actions
+
+POLICIES = {
+    "random": random_policy,
+    "idle": idle_policy,
+    "cautious": cautious_policy,
+}
+
+def load_policy(name):
+    # A built-in policy, or any policy(state, rng) function as module:function
+    if name in POLICIES:
+        return POLICIES[name]
+    module, _, function = name.partition(":")
+    if not function:
+        raise ValueError(f"unknown policy {name!r}, use one of {', '.join(POLICIES)} or module:function")
+    return getattr(importlib.import_module(module), function)
+
+RESULT_FIELDS = ["policy", "level", "seed", "hunters", "max_ticks", "cleared", "score", "lives_lost", "ticks",
+                 "enemies_killed"]
+
+def play(job):
+    # One bot against one seeded level, until the level is cleared, the
+    # game is over or the tick limit runs out
+    policy_name, level, seed, hunters, max_ticks = job
+    policy = load_policy(policy_name)
+    state = GameState(level=level, seed=seed, monster_types=HUNTER_TYPES if hunters else MONSTER_TYPES)
+    rng = random.Random(f"{seed}/bot")
+    lives = state.player.lives
+    killed = ticks = 0
+    cleared = False
+    
+    while ticks < max_ticks and not state.game_over:
+        events = state.step(policy(state, rng))
+        ticks += 1
+        killed += events.count("enemy_died")
+        if "level_complete" in events:
+            cleared = True
+            break
+    
+    return {
+        "policy": policy_name, "level": level, "seed": seed, "hunters": hunters, "max_ticks": max_ticks,
+        "cleared": cleared,
+        "score": state.player.score, "lives_lost": lives - state.player.lives,
+        "ticks": ticks, "enemies_killed": killed,
+    }
+
+def result_key(result):
+    return (result["policy"], int(result["level"]), int(result["seed"]))
+
+def result_settings(result):
+    # (hunters, max_ticks) a result was played with, None for files written
+    # before they were recorded. CSV files hold them as strings.
+    if result.get("max_ticks") in (None, ""):
+        return None
+    return str(result["hunters"]) == "True", int(result["max_ticks"])
+
+def read_results(path):
+    # Results already in the output file, for resuming a run. A line cut off
+    # by an interrupted run is dropped from the file.
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = data[:end].decode().splitlines()
+    if path.endswith(".csv"):
+        return list(csv.DictReader(lines))
+    return [json.loads(line) for line in lines if line]
+
+class ResultWriter:
+    # Appends results to a JSONL or CSV file (picked by the extension) as
+    # they come in, so an interrupted run loses at most the games in flight
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="")
+        self.csv = None
+        if path.endswith(".csv"):
+            self.csv = csv.DictWriter(self.file, RESULT_FIELDS)
+            if new:
+                self.csv.writeheader()
+    
+    def write(self, result):
+        if self.csv:
+            self.csv.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+def summarize(results):
+    # Per-policy averages over everything in the output file
+    by_policy = {}
+    for result in results:
+        by_policy.setdefault(result["policy"], []).append(result)
+    for policy, games in sorted(by_policy.items()):
+        count = len(games)
+        cleared = sum(str(game["cleared"]) == "True" for game in games)
+        score = sum(int(game["score"]) for game in games) / count
+        killed = sum(int(game["enemies_killed"]) for game in games) / count
+        ticks = sum(int(game["ticks"]) for game in games) / count
+        print(f"{policy:>12}: {count} games, {cleared / count:.0%} cleared, mean score {score:.0f}, "
+              f"{killed:.2f} enemies killed, {ticks:.0f} ticks")
+
+def run_tournament(policies, levels, level=1, first_seed=0, hunters=False, max_ticks=5400, out="tournament.jsonl",
+                   workers=None):
+    # Play every policy on `levels` seeded levels over a process pool,
+    # skipping the games an earlier run of the same output file finished
+    for name in policies:
+        load_policy(name)
+    results = read_results(out)
+    other = {result_settings(result) for result in results} - {(hunters, max_ticks)}
+    if other:
+        raise ValueError(f"{out} holds games played with other settings than hunters={hunters}, "
+                         f"max_ticks={max_ticks}; use another --out")
+    done = {result_key(result) for result in results}
+    jobs = [(name, level, seed, hunters, max_ticks)
+            for seed in range(first_seed, first_seed + levels) for name in policies
+            if (name, level, seed) not in done]
+    workers = workers or os.cpu_count() or 1
+    print(f"{len(jobs)} games to play on {workers} workers ({len(done)} already in {out})")
+    
+    writer = ResultWriter(out)
+    start = time.perf_counter()
+    try:
+        with Pool(workers) as pool:
+            chunksize = max(1, len(jobs) // (workers * 16))
+            for count, result in enumerate(pool.imap_unordered(play, jobs, chunksize), 1):
+                writer.write(result)
+                results.append(result)
+                if count % 100 == 0:
+                    print(f"{count}/{len(jobs)} games")
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    
+    print(f"Played {len(jobs)} games in {elapsed:.1f}s ({len(jobs) / max(elapsed, 1e-9):,.1f} games/sec)")
+    summarize(results)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play bots against seeded levels over a process pool")
+    parser.add_argument("policies", nargs="*", default=list(POLICIES), metavar="policy",
+                        help=f"bots to evaluate: {', '.join(POLICIES)} or module:function (default: all built-in)")
+    parser.add_argument("--levels", type=int, default=100, help="number of seeded levels to play each bot on")
+    parser.add_argument("--level", type=int, default=1, help="level number to play (more enemies the higher)")
+    parser.add_argument("--first-seed", type=int, default=0, help="seed of the first level")
+    parser.add_argument("--hunters", action="store_true", help="also spawn hunters that chase the player")
+    parser.add_argument("--max-ticks", type=int, default=5400, help="tick limit per game (default: 3 minutes)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--out", default="tournament.jsonl",
+                        help="results file, .jsonl or .csv; an existing one is resumed")
+    args = parser.parse_args(argv)
+    try:
+        run_tournament(args.policies, args.levels, args.level, args.first_seed, args.hunters, args.max_ticks,
+                       args.out, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        print("Interrupted, run again with the same --out to resume")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
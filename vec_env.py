@@ -0,0 +1,646 @@
+import sys
+import argparse
+
+import numpy as np
+
+from bomberman import (BLOCK, BOMB_FUSE, BOMB_RANGE, EMPTY, ENEMY_MOVE_DELAY, ENEMY_SCORE,
+                       EXPLOSION_TICKS, FLOW_DIRECTIONS, GRID_HEIGHT, GRID_WIDTH, LIFE_BONUS,
+                       MONSTER_BEHAVIORS, MOVE_ACTIONS, MOVE_COOLDOWN, PLAYER_START, REPLAY_BOMB,
+                       REPLAY_MOVES, RESPAWN_TICKS, START_LIVES, WALL, GameState, decode_actions, open_pockets)
+
+# Directions in the order Enemy.update tries them, and the order blast_tiles
+# walks its rays in (which decides the order of a chain reaction)
+ENEMY_DIRECTIONS = FLOW_DIRECTIONS
+BLAST_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+# Marks a bomb that isn't queued to go off
+NOT_QUEUED = np.iinfo(np.int32).max
+
+LEVEL_BATCH = 2048  # Fresh levels made at a time
+
+def sweep(label, walled):
+    # Carry the smallest label along the first axis, forwards then
+    # backwards, never into or out of a walled tile
+    for i in range(1, len(label)):
+        np.maximum(np.minimum(label[i], label[i - 1]), walled[i], out=label[i])
+    for i in range(len(label) - 2, -1, -1):
+        np.maximum(np.minimum(label[i], label[i + 1]), walled[i], out=label[i])
+
+def open_pockets_batch(maps, width):
+    # open_pockets() on many maps at once, in place and with the same
+    # result. `maps` holds one map per column, laid out down it like
+    # Grid.cells, so that each tile is a row and an operation on a row
+    # covers every map.
+    #
+    # Instead of flood fills, every group of connected empty tiles is
+    # labelled up front with its first tile: sweeps along the rows and
+    # columns, both ways, carry the smallest label on until a round of them
+    # changes nothing. The groups are then visited in the order of their
+    # first tiles, like open_pockets() finds them, and a group nothing has
+    # reached yet gets its tunnel, which reaches it and every group the
+    # tunnel passes next to.
+    size, count = maps.shape
+    height = size // width
+    dtype = np.min_scalar_type(size)
+    # Tiles that aren't empty keep label `size`
+    walled = np.multiply(maps != EMPTY, size, dtype=dtype).reshape(height, width, count)
+    label = np.maximum(np.arange(size, dtype=dtype).reshape(height, width, 1), walled)
+    # The sweeps along the rows go over a (width, height, count) copy, so
+    # that every sweep step covers one contiguous block
+    walled_across = np.ascontiguousarray(walled.transpose(1, 0, 2))
+    while True:
+        before = label
+        label = np.ascontiguousarray(label.transpose(1, 0, 2))
+        sweep(label, walled_across)
+        label = np.ascontiguousarray(label.transpose(1, 0, 2))
+        sweep(label, walled)
+        if np.array_equal(label, before):
+            break
+    label = label.reshape(size, count)
+    
+    # heads[k] is the first tile of every map's k-th group, `size` past the
+    # last one
+    first = label == np.arange(size, dtype=dtype)[:, None]
+    games, tiles = np.nonzero(first.T)  # In order of map, then tile
+    groups = np.bincount(games, minlength=count)
+    rank = np.arange(len(games)) - (np.cumsum(groups) - groups)[games]
+    heads = np.full((groups.max(), count), size, np.int64)
+    heads[rank, games] = tiles
+    
+    # Which groups are reached, by label, with the label `size` of tiles
+    # that aren't empty counting as reached
+    reached = np.zeros(count * (size + 1), bool)
+    base = np.arange(count) * (size + 1)
+    reached[base + size] = True
+    reached[base + label[PLAYER_START[1] * width + PLAYER_START[0]]] = True
+    cells, labels = maps.reshape(-1), label.reshape(-1)
+    around = np.array([1, -1, width, -width]) * count
+    # The tile a tunnel goes on to from each tile, the way open_pockets()
+    # digs: up, or left when a pillar is in the way, staying put once in
+    # the clear start area
+    tile = np.arange(size)
+    up = (tile % width % 2 == 1) & (tile >= 2 * width)
+    onward = np.where(tile > width + 1, tile - np.where(up, width, 1), tile)
+    for head in heads:
+        games = np.flatnonzero(~reached[base + head])
+        tiles = head[games]
+        reached[base[games] + tiles] = True
+        # Dig every tunnel on a step at a time until it comes out on an
+        # empty tile
+        while len(games):
+            tiles = onward[tiles]
+            at = tiles * count + games
+            dig = cells[at] != EMPTY
+            games, tiles, at = games[dig], tiles[dig], at[dig]
+            cells[at] = EMPTY
+            reached[base[games, None] + labels[at[:, None] + around]] = True
+
+class VecBombermanEnv:
+    # Many independent single-level games stepped in lockstep. Every game's
+    # grid, player, enemies, bombs and fire live in stacked NumPy arrays and
+    # each tick is a fixed number of array operations over all games, with
+    # the same rules and phase order as GameState.step(). An episode ends
+    # when the level is cleared or the game is over, and that game starts
+    # over on a fresh map right away.
+    #
+    # Per-enemy and per-bomb arrays are (slot, game), so that the games are
+    # the long contiguous axis every operation runs along. Positions are
+    # flat tile indices, y * width + x. Ticks, positions and counters are
+    # int32, which halves the memory every full-width operation goes over.
+    #
+    # Times are ticks of one clock all the games share, so most checks
+    # compare against a single number. A game's own tick (GameState.tick)
+    # is the clock less the clock it started at.
+    #
+    # Actions are one int per game, encoded like replay inputs (see
+    # bomberman.encode_actions): a move code in the low bits plus
+    # REPLAY_BOMB to drop a bomb. Only wandering enemies are simulated, and
+    # maps must have the outer wall create_grid() builds.
+    def __init__(self, num_envs, seed=None, enemies=3, bombs=1, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.num_envs = num_envs
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.num_enemies = enemies
+        self.num_bombs = bombs
+        self.rng = np.random.default_rng(seed)
+        
+        n, size = num_envs, self.size
+        self.grid = np.zeros((n, size), np.uint8)
+        self.burn = np.zeros((n, size), np.int32)  # Last tick each tile burns on, -1 when not burning
+        self.open = np.zeros((n, size), bool)  # Tiles that can be walked onto: empty and without a bomb
+        self.burning_until = np.zeros(n, np.int32)  # Last tick any tile burns on
+        self.clock = 0
+        self.started = np.zeros(n, np.int32)
+        
+        self.player = np.zeros(n, np.int32)
+        self.lives = np.zeros(n, np.int32)
+        self.score = np.zeros(n, np.int32)
+        self.alive = np.zeros(n, bool)
+        self.bombs_left = np.zeros(n, np.int32)
+        self.next_move_at = np.zeros(n, np.int32)
+        self.respawn_at = np.zeros(n, np.int32)
+        
+        self.enemy = np.zeros((enemies, n), np.int32)
+        self.enemy_direction = np.zeros((enemies, n), np.int32)  # Index into ENEMY_DIRECTIONS
+        self.enemy_alive = np.zeros((enemies, n), bool)
+        self.enemy_dying = np.zeros((enemies, n), bool)  # Killed last tick, scored this one
+        # Tick each game's enemies step on next. A level's enemies all spawn
+        # together and step every ENEMY_MOVE_DELAY ticks, so they share it.
+        self.enemy_next_move_at = np.zeros(n, np.int32)
+        self.dying = np.zeros(n, bool)  # Whether any enemy is dying
+        self.enemy_moved = np.zeros(n, bool)  # Whether any enemy moved last tick
+        # Direction each enemy turned to this tick after bumping into
+        # something, -1 if it didn't have to pick one. Only kept up to date
+        # when record_turns is set, check_parity() needs them.
+        self.turns = np.full((enemies, n), -1, np.int32)
+        self.record_turns = False
+        
+        self.bomb = np.zeros((bombs, n), np.int32)
+        self.bomb_live = np.zeros((bombs, n), bool)
+        self.detonate_at = np.zeros((bombs, n), np.int32)
+        
+        # Flat views for gathering one tile per game
+        self.offsets = np.arange(n, dtype=np.int64) * size
+        self.grid_flat = self.grid.reshape(-1)
+        self.burn_flat = self.burn.reshape(-1)
+        self.open_flat = self.open.reshape(-1)
+        # Single enemy or bomb slots are picked out of the raveled (slot, game)
+        # arrays, at slot * num_envs + game; slot_game maps that back to the game
+        self.slot_game = np.tile(np.arange(n, dtype=np.int64), max(enemies, bombs))
+        self.enemy_slots = np.arange(enemies, dtype=np.int64)[:, None] * n
+        
+        self.enemy_steps = np.array([dx + dy * width for dx, dy in ENEMY_DIRECTIONS], np.int32)
+        # Blast ray tiles around a bomb, ray by ray outwards from it
+        self.blast_steps = np.array([(dx + dy * width) * r for dx, dy in BLAST_DIRECTIONS
+                                     for r in range(1, BOMB_RANGE + 1)], np.int32)
+        self.move_steps = np.zeros(8, np.int32)
+        for code, action in enumerate(REPLAY_MOVES):
+            if action:
+                dx, dy = MOVE_ACTIONS[action]
+                self.move_steps[code] = dx + dy * width
+        
+        # Static parts of the map layout, the same for every game
+        ys, xs = np.divmod(np.arange(size), width)
+        border = (xs == 0) | (ys == 0) | (xs == width - 1) | (ys == height - 1)
+        pillars = (xs % 2 == 0) & (ys % 2 == 0) & (xs >= 2) & (xs < width - 2) & (ys >= 2) & (ys < height - 2)
+        self.walls = border | pillars
+        self.block_spots = ~self.walls & ~((xs < 3) & (ys < 3))  # The start area stays clear
+        self.spawn_spots = (xs > 3) | (ys > 3)
+        self.start = PLAYER_START[1] * width + PLAYER_START[0]
+        
+        # Fresh levels (maps, enemy tiles and directions) not used yet
+        self.stock = [np.empty((0, size), np.uint8), np.empty((0, enemies), np.int32),
+                      np.empty((0, enemies), np.int32)]
+        
+        self.reset()
+    
+    def make_levels(self, count):
+        # New level 1 layouts, made the way generate_level() does: blocks
+        # laid down at random, then the open_pockets() pass so that every
+        # empty tile can be walked to. Each enemy goes on a uniformly picked
+        # empty tile away from the start (unlike spawn_enemies(), two can
+        # share a tile). Returns them one level per row, like the grid.
+        rng = self.rng
+        maps = np.zeros((self.size, count), np.uint8)
+        maps[self.walls] = WALL
+        spots = np.flatnonzero(self.block_spots)
+        maps[spots] = np.multiply(rng.random((len(spots), count), np.float32) < 0.3, BLOCK, dtype=np.uint8)
+        open_pockets_batch(maps, self.width)
+        
+        # Tiles away from the start are drawn for the enemies until they
+        # land on empty ones, which leaves each pick uniform over those
+        spots = np.flatnonzero(self.block_spots & self.spawn_spots)
+        enemies = np.empty((count, self.num_enemies), np.int32)
+        left = np.arange(enemies.size)
+        while len(left):
+            tiles = spots[rng.integers(0, len(spots), len(left))]
+            empty = maps.ravel()[tiles * count + left // self.num_enemies] == EMPTY
+            enemies.ravel()[left[empty]] = tiles[empty]
+            left = left[~empty]
+        directions = rng.integers(0, len(ENEMY_DIRECTIONS), (count, self.num_enemies), np.int32)
+        return maps.T.copy(), enemies, directions
+    
+    def take_levels(self, count):
+        # `count` fresh levels off the stock. Making maps costs a lot less
+        # per map in bulk, so the stock is filled up LEVEL_BATCH at a time.
+        stock = self.stock
+        if len(stock[0]) < count:
+            more = self.make_levels(max(LEVEL_BATCH, count - len(stock[0])))
+            stock = [np.concatenate(parts) for parts in zip(stock, more)]
+        self.stock = [part[count:] for part in stock]
+        return [part[:count] for part in stock]
+    
+    def reset(self, games=None):
+        # Start the given games (all of them by default) on a fresh level 1 map
+        if games is None:
+            games = np.arange(self.num_envs)
+        count = len(games)
+        if not count:
+            return
+        maps, enemies, directions = self.take_levels(count)
+        
+        self.grid[games] = maps
+        self.burn[games] = -1
+        self.open[games] = maps == EMPTY
+        self.burning_until[games] = -1
+        self.started[games] = self.clock
+        
+        self.player[games] = self.start
+        self.lives[games] = START_LIVES
+        self.score[games] = 0
+        self.alive[games] = True
+        self.bombs_left[games] = self.num_bombs
+        self.next_move_at[games] = 0
+        self.respawn_at[games] = 0
+        
+        self.enemy[:, games] = enemies.T
+        self.enemy_direction[:, games] = directions.T
+        self.enemy_alive[:, games] = True
+        self.enemy_dying[:, games] = False
+        self.dying[games] = False
+        self.enemy_moved[games] = False
+        self.enemy_next_move_at[games] = self.clock + ENEMY_MOVE_DELAY
+        
+        self.bomb_live[:, games] = False
+    
+    def load(self, index, state):
+        # Copy a GameState into game `index`, e.g. to check this environment
+        # against the scalar engine or to start from a real game
+        if (state.grid.width, state.grid.height) != (self.width, self.height):
+            raise ValueError("map size doesn't match the environment")
+        if any(MONSTER_BEHAVIORS[enemy.monster_type] != "wander" for enemy in state.enemies):
+            raise ValueError("only wandering enemies are supported")
+        if len(state.enemies) > self.num_enemies or len(state.bombs) > self.num_bombs:
+            raise ValueError("more enemies or bombs than the environment has room for")
+        moves = {enemy.next_move_at for enemy in state.enemies if enemy.alive}
+        if len(moves) > 1:
+            raise ValueError("the enemies don't all step on the same ticks")
+        width = self.width
+        started = self.clock - state.tick
+        
+        def on_clock(tick):
+            # Tick 0 stands for "not set" in GameState and stays 0 here
+            return tick + started if tick else 0
+        
+        self.grid[index] = np.frombuffer(bytes(state.grid.cells), np.uint8)
+        self.burn[index] = -1
+        for explosion in state.explosions:
+            for x, y in explosion.tiles:
+                i = y * width + x
+                self.burn[index, i] = max(self.burn[index, i], explosion.expire_at + started)
+        self.burning_until[index] = self.burn[index].max()
+        self.started[index] = started
+        
+        player = state.player
+        self.player[index] = player.y * width + player.x
+        self.lives[index] = player.lives
+        self.score[index] = player.score
+        self.alive[index] = player.alive
+        self.bombs_left[index] = player.bombs
+        self.next_move_at[index] = on_clock(player.next_move_at)
+        self.respawn_at[index] = on_clock(state.respawn_at)
+        
+        self.enemy_alive[:, index] = False
+        self.enemy_dying[:, index] = False
+        self.turns[:, index] = -1
+        for slot, enemy in enumerate(state.enemies):
+            self.enemy[slot, index] = enemy.y * width + enemy.x
+            self.enemy_direction[slot, index] = ENEMY_DIRECTIONS.index(enemy.direction)
+            self.enemy_alive[slot, index] = enemy.alive
+            self.enemy_dying[slot, index] = enemy in state.dying
+        self.dying[index] = self.enemy_dying[:, index].any()
+        self.enemy_next_move_at[index] = moves.pop() + started if moves else 0
+        self.enemy_moved[index] = True  # So the next tick checks them all against the fire
+        
+        self.bomb_live[:, index] = False
+        self.open[index] = self.grid[index] == EMPTY
+        for slot, bomb in enumerate(state.bombs):
+            self.bomb[slot, index] = bomb.y * width + bomb.x
+            self.detonate_at[slot, index] = bomb.detonate_at + started
+            self.bomb_live[slot, index] = True
+            self.open[index, bomb.y * width + bomb.x] = False
+    
+    def hit_player(self, games):
+        self.lives[games] -= 1
+        dead = self.lives[games] <= 0
+        self.alive[games[dead]] = False
+        respawn = games[~dead]
+        self.respawn_at[respawn] = self.clock + RESPAWN_TICKS
+    
+    def step(self, actions):
+        # Advance every game by one tick. Returns each game's reward (the
+        # points it scored) and whether its episode ended; ended games have
+        # already been reset when this returns.
+        #
+        # Like GameState.step(), the fire, scoring, collision and win checks
+        # only look at the games where something can have changed them, so
+        # a quiet tick costs a handful of operations over all games.
+        actions = np.asarray(actions, np.int32)
+        n = self.num_envs
+        self.clock += 1
+        clock = self.clock
+        offsets = self.offsets
+        if self.record_turns:
+            self.turns.fill(-1)
+        
+        # Drop bombs. One dropped into a blast goes off right away, ahead of
+        # the ones whose fuse runs out this tick.
+        hot = np.empty(0, np.int64)
+        drop = np.flatnonzero(actions >= REPLAY_BOMB)  # The bomb bit is the top one
+        if len(drop):
+            here = offsets[drop] + self.player[drop]
+            free = self.open_flat[here] & (self.bombs_left[drop] > 0)
+            drop, here = drop[free], here[free]
+            slots = self.bomb_live.take(drop, axis=1).argmin(axis=0) * n + drop
+            self.bomb.ravel()[slots] = self.player[drop]
+            self.detonate_at.ravel()[slots] = clock - 1 + BOMB_FUSE
+            self.bomb_live.ravel()[slots] = True
+            self.open_flat[here] = False
+            self.bombs_left[drop] -= 1
+            hot = slots[self.burn_flat[here] >= clock]
+        
+        # Respawn, or move the player (with the cooldown on held keys). Only
+        # the players trying to step onto a tile are picked out, as reading
+        # one tile of every game's map costs more than finding those.
+        respawned = self.respawn_at == clock
+        if respawned.any():
+            self.player[respawned] = self.start
+        movers = self.alive & (self.respawn_at < clock)
+        vulnerable = movers | respawned
+        move = actions & 7
+        released = (move == 0) & movers  # Releasing the keys resets the cooldown
+        np.multiply(self.next_move_at, ~released, out=self.next_move_at)
+        trying = np.flatnonzero((movers ^ released) & (self.next_move_at <= clock))
+        self.next_move_at[trying] = clock + MOVE_COOLDOWN
+        steps = self.move_steps.take(move[trying])
+        moved = self.open_flat[offsets[trying] + self.player[trying] + steps]
+        self.player[trying] += steps * moved
+        player_moved = respawned
+        player_moved[trying] = moved
+        
+        # Bombs whose fuse ran out join the queue, then the chain reactions
+        # are resolved one explosion per game per round
+        # Games where an enemy may have met fire. move_enemies() hands back a
+        # new array, so this one is free to mark.
+        new_fire = self.enemy_moved
+        due = self.bomb_live & (self.detonate_at == clock)
+        if len(hot) or due.any():
+            due = np.flatnonzero(due)
+            queue = np.full(self.bomb.shape, NOT_QUEUED, np.int32)
+            order = queue.ravel()
+            queued = np.zeros(n, np.int32)
+            order[hot] = 0
+            queued[self.slot_game[hot]] = 1
+            due = due[order[due] == NOT_QUEUED]
+            games = self.slot_game[due]
+            order[due] = queued[games]
+            queued[games] += 1
+            games = np.flatnonzero(queued > 0)
+            new_fire[games] = True
+            while len(games):
+                slots = queue.take(games, axis=1).argmin(axis=0) * n + games
+                order[slots] = NOT_QUEUED
+                self.explode(games, slots, queue, queued)
+                games = games[(queue.take(games, axis=1) != NOT_QUEUED).any(axis=0)]
+        
+        # Blasts hit the player (expiring ones still burn this tick)
+        burning = np.flatnonzero(vulnerable & (self.burning_until >= clock))
+        hit = burning[self.burn_flat[offsets[burning] + self.player[burning]] >= clock]
+        if len(hit):
+            self.hit_player(hit)
+            vulnerable[hit] = False  # Dead or waiting to respawn now
+        
+        # Enemies killed on the last tick are scored now
+        scored = np.flatnonzero(self.dying)
+        rewards = np.zeros(n, np.int32)
+        rewards[scored] = ENEMY_SCORE * self.enemy_dying.take(scored, axis=1).sum(axis=0, dtype=np.int32)
+        self.enemy_dying[:, scored] = False
+        self.dying[scored] = False
+        
+        # Then blasts kill the enemies standing in them. An enemy can only be
+        # caught by a bomb that just went off or by walking into the fire.
+        fire = np.flatnonzero(new_fire & (self.burning_until > clock))
+        if len(fire):
+            slots = (self.enemy_slots + fire).ravel()
+            slots = slots[self.enemy_alive.ravel()[slots]]
+            games = self.slot_game[slots]
+            slots = slots[self.burn_flat[offsets[games] + self.enemy.ravel()[slots]] > clock]
+            self.enemy_alive.ravel()[slots] = False
+            self.enemy_dying.ravel()[slots] = True
+            self.dying[self.slot_game[slots]] = True
+        
+        self.enemy_moved = self.move_enemies()
+        
+        # Enemies walking into the player, or the other way round
+        caught = np.zeros(n, bool)
+        for slot in range(self.num_enemies):
+            caught |= self.enemy_alive[slot] & (self.enemy[slot] == self.player)
+        caught &= (player_moved | self.enemy_moved) & vulnerable
+        if caught.any():
+            self.hit_player(np.flatnonzero(caught))
+        
+        # The level is cleared once the last enemy has been scored
+        left = (self.enemy_alive.take(scored, axis=1) | self.enemy_dying.take(scored, axis=1)).any(axis=0)
+        won = scored[self.alive[scored] & ~left]
+        rewards[won] += self.lives[won] * LIFE_BONUS
+        self.score[scored] += rewards[scored]  # Nothing else scores, and the games won are among these
+        
+        dones = ~self.alive
+        dones[won] = True
+        self.reset(np.flatnonzero(dones))
+        return rewards, dones
+    
+    def explode(self, games, slots, queue, queued):
+        # The explosion of one bomb in each of these games, like Explosion
+        # and blast_tiles: rays stop at walls, blocks take the blast and stop it
+        offsets = self.offsets[games]
+        expire = self.clock - 1 + EXPLOSION_TICKS
+        centre = self.bomb.ravel()[slots]
+        self.bomb_live.ravel()[slots] = False
+        self.open_flat[offsets + centre] = True
+        self.bombs_left[games] += 1
+        self.burn_flat[offsets + centre] = expire
+        self.burning_until[games] = expire
+        
+        # All the rays at once: each reaches up to the first wall, and takes
+        # in the first block. Tiles past the border wall are read too (from
+        # the next game, or clipped at either end of the batch) but never
+        # reached.
+        tiles = centre[:, None] + self.blast_steps
+        flat = offsets[:, None] + tiles
+        kind = self.grid_flat.take(flat, mode="clip")
+        rays = kind.reshape(len(games), len(BLAST_DIRECTIONS), BOMB_RANGE)
+        reached = rays != WALL
+        stopped = rays[:, :, 0] != EMPTY
+        for r in range(1, BOMB_RANGE):
+            reached[:, :, r] &= ~stopped
+            stopped |= rays[:, :, r] != EMPTY
+        reached = reached.reshape(len(games), -1)
+        cells = np.flatnonzero(reached)
+        hit = flat.ravel()[cells]
+        self.burn_flat[hit] = expire
+        broken = hit[kind.ravel()[cells] == BLOCK]
+        self.grid_flat[broken] = EMPTY
+        self.open_flat[broken] = True
+        
+        # Bombs in the way (the only tiles reached that still can't be walked
+        # onto) are queued in the order the rays reach them
+        if self.open_flat[hit].all():
+            return
+        waiting = self.bomb_live.take(games, axis=1) & (queue.take(games, axis=1) == NOT_QUEUED)
+        bombs = np.where(waiting, self.bomb.take(games, axis=1), -1).T
+        caught = (bombs[:, :, None] == tiles[:, None, :]) & reached[:, None, :]
+        rows, bomb_slots = np.nonzero(caught.any(axis=2))
+        if len(rows):
+            ray_index = caught.argmax(axis=2)
+            ahead = caught.any(axis=2)[rows, :] & (ray_index[rows, :] < ray_index[rows, bomb_slots, None])
+            chained = games[rows]
+            queue[bomb_slots, chained] = queued[chained] + ahead.sum(axis=1)
+            np.add.at(queued, chained, 1)
+    
+    def move_enemies(self):
+        # Enemy.update for every enemy whose turn it is: keep walking, or
+        # turn to a random free direction when blocked by a wall, a block or
+        # a bomb. Returns which games had an enemy move.
+        n = self.num_envs
+        enemy_moved = np.zeros(n, bool)
+        games = np.flatnonzero(self.enemy_next_move_at == self.clock)
+        if not len(games):
+            return enemy_moved
+        self.enemy_next_move_at[games] += ENEMY_MOVE_DELAY
+        due = (self.enemy_slots + games).ravel()
+        due = due[self.enemy_alive.ravel()[due]]
+        games = self.slot_game[due]
+        
+        here = self.enemy.ravel()[due]
+        flat = self.offsets[games] + here
+        direction = self.enemy_direction.ravel()[due]
+        ahead = self.open_flat[flat + self.enemy_steps.take(direction)]
+        
+        # A blocked enemy picks one of the free directions, each as likely.
+        # `counts` holds how many of the directions up to each one are free,
+        # so the pick is the number of them that don't reach past it.
+        blocked = np.flatnonzero(~ahead)
+        free = self.open_flat[flat[blocked] + self.enemy_steps[:, None]]
+        counts = free.astype(np.int32)
+        for k in range(1, len(counts)):
+            counts[k] += counts[k - 1]
+        options = counts[-1]
+        picks = (self.rng.random(len(blocked)) * options).astype(np.int32)
+        choice = np.zeros(len(blocked), np.int32)
+        for count in counts[:-1]:
+            choice += count <= picks
+        turning = options > 0
+        turned = blocked[turning]
+        direction[turned] = choice[turning]
+        self.enemy_direction.ravel()[due] = direction
+        if self.record_turns:
+            self.turns.ravel()[due[turned]] = choice[turning]
+        
+        ahead[turned] = True
+        self.enemy.ravel()[due] = here + self.enemy_steps.take(direction) * ahead
+        enemy_moved[games[ahead]] = True
+        return enemy_moved
+    
+    def observe(self):
+        # (games, 5, height, width) uint8 planes: tile types, player, number of
+        # enemies, bombs and burning tiles
+        n, size = self.num_envs, self.size
+        planes = np.zeros((n, 5, size), np.uint8)
+        planes[:, 0] = self.grid
+        planes[np.arange(n), 1, self.player] = 1
+        slots, games = np.nonzero(self.enemy_alive)
+        np.add.at(planes[:, 2], (games, self.enemy[slots, games]), 1)
+        planes[:, 3] = ~self.open & (self.grid == EMPTY)
+        planes[:, 4] = self.burn > self.clock
+        return planes.reshape(n, 5, self.height, self.width)
+
+def random_actions(rng, count):
+    # Random inputs in the replay encoding: moves now and then, the odd bomb
+    moves = np.where(rng.random(count) < 0.3, rng.integers(1, 5, count), 0)
+    bombs = np.where(rng.random(count) < 0.05, REPLAY_BOMB, 0)
+    return (moves | bombs).astype(np.int32)  # What step() works in, so it takes them as they are
+
+class TurnQueue:
+    # Stands in for a game's random stream in check_parity(): hands the
+    # scalar enemies the turns the batch environment picked, in order
+    def __init__(self, turns):
+        self.turns = list(turns)
+    
+    def choice(self, options):
+        turn = self.turns.pop(0)
+        assert turn in options, "enemy turned a way the scalar engine doesn't allow"
+        return turn
+
+def check_parity(num_envs=64, ticks=3000, seed=0):
+    # Play the same inputs on the batch environment and on one GameState
+    # per game, feeding the scalar enemies the same random turns, and
+    # compare the games after every tick. Returns the number of mismatches
+    # and sealed maps.
+    env = VecBombermanEnv(num_envs, seed=seed)
+    env.record_turns = True
+    # The maps the environment makes itself have to be as open as the
+    # engine's: opening them up again changes nothing
+    sealed = 0
+    for row in env.grid:
+        cells = bytearray(row.tobytes())
+        open_pockets(cells, env.width)
+        sealed += cells != row.tobytes()
+    states = [GameState(seed=f"{seed}/{i}") for i in range(num_envs)]
+    for i, state in enumerate(states):
+        env.load(i, state)
+    rng = np.random.default_rng(seed)
+    width = env.width
+    mismatches = episodes = 0
+    
+    for _ in range(ticks):
+        codes = random_actions(rng, num_envs)
+        rewards, dones = env.step(codes)
+        for i, state in enumerate(states):
+            score = state.player.score
+            state.rng = TurnQueue(ENEMY_DIRECTIONS[turn] for turn in env.turns[:, i] if turn >= 0)
+            state.step(decode_actions(int(codes[i])))
+            player = state.player
+            
+            ok = (not state.rng.turns and rewards[i] == player.score - score and
+                  dones[i] == (state.win or state.game_over))
+            if ok and not dones[i]:
+                # Times compared on the environment's clock, see load()
+                started = int(env.started[i])
+                times = [tick + started if tick else 0 for tick in (player.next_move_at, state.respawn_at)]
+                enemies = [(enemy.y * width + enemy.x, enemy.alive) for enemy in state.enemies]
+                slots = np.flatnonzero(env.enemy_alive[:, i] | env.enemy_dying[:, i])
+                bombs = np.flatnonzero(env.bomb_live[:, i])
+                ok = (env.clock - started == state.tick and env.grid[i].tobytes() == bytes(state.grid.cells) and
+                      np.array_equal(env.burn[i] > env.clock, np.frombuffer(state.fire.counts, np.uint16) > 0) and
+                      env.player[i] == player.y * width + player.x and
+                      (env.lives[i], env.score[i], env.bombs_left[i]) == (player.lives, player.score, player.bombs) and
+                      [env.next_move_at[i], env.respawn_at[i]] == times and
+                      enemies == list(zip(env.enemy[slots, i].tolist(), env.enemy_alive[slots, i].tolist())) and
+                      sorted((bomb.y * width + bomb.x, bomb.detonate_at + started) for bomb in state.bombs) ==
+                      sorted(zip(env.bomb[bombs, i].tolist(), env.detonate_at[bombs, i].tolist())) and
+                      np.array_equal(np.flatnonzero(~env.open[i] & (env.grid[i] == EMPTY)), np.sort(env.bomb[bombs, i])))
+            mismatches += not ok
+            
+            if dones[i]:
+                # Carry on checking with a fresh pair of games
+                episodes += 1
+                states[i] = GameState(seed=f"{seed}/{i}/{episodes}")
+                env.load(i, states[i])
+    
+    print(f"parity: {num_envs} games x {ticks} ticks ({episodes} episodes), {mismatches} mismatching game ticks, "
+          f"{sealed} maps with sealed pockets")
+    return mismatches + sealed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the batch environment against the scalar engine")
+    parser.add_argument("--envs", type=int, default=64, help="games to run side by side")
+    parser.add_argument("--ticks", type=int, default=3000, help="ticks to compare")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if check_parity(args.envs, args.ticks, args.seed):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()